@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# api_benchmark.py
+#
+# Drives the nekos.moe, waifu.im and Danbooru sources headlessly against a
+# local server imitating their APIs and image CDNs, then reports time to
+# first image, images per second, requests per image, peak RSS and CPU
+# time per downloaded MB as JSON. Every source runs in a fresh subprocess
+# so ru_maxrss is the peak of that run alone.
+#
+# Usage: python3 benchmarks/api_benchmark.py [--images 50] [--latency-ms 20]
+#            [--bandwidth-mbps 0] [--error-rate 0] [--forbidden-rate 0.1]
+#            [--image-kb 200] [--decode] [--output results.json]
+
+import argparse
+import http.server
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SOURCES = ("catgirl", "waifu", "danbooru")
+API_PATHS = ("/nekos.moe/api/v1/random/image", "/api.waifu.im/images", "/danbooru.donmai.us/posts.json")
+WRITE_CHUNK = 64 * 1024
+
+
+def _make_png(target_bytes: int) -> tuple:
+    """Returns (png, side) for a square of noise, which barely compresses, of about target_bytes."""
+    side = max(1, int(math.sqrt(target_bytes / 3)))
+    raw = b"".join(b"\x00" + os.urandom(side * 3) for _ in range(side))
+
+    def _chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    png = (b"\x89PNG\r\n\x1a\n"
+           + _chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0))
+           + _chunk(b"IDAT", zlib.compress(raw, 1))
+           + _chunk(b"IEND", b""))
+    return png, side
+
+
+class _MockServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = args.latency_ms / 1000
+        self.bandwidth = args.bandwidth_mbps * 1024 * 1024 / 8
+        self.error_rate = args.error_rate
+        self.error_status = args.error_status
+        self.forbidden_rate = args.forbidden_rate
+        self.image, self.image_side = _make_png(int(args.image_kb * 1024))
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.reset()
+        from src.danbooru import _forbidden_tags
+        self.forbidden_tags = _forbidden_tags()
+
+    def reset(self) -> dict:
+        with self.lock:
+            counters = getattr(self, "counters", {})
+            self.counters = {"api_requests": 0, "image_requests": 0, "errors": 0, "bytes_sent": 0}
+        return counters
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[key] += value
+
+    def handle_error(self, request, client_address):
+        # Clients closing keep-alive connections at exit are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def next_ids(self, count: int) -> list:
+        with self.lock:
+            return [next(self.ids) for _ in range(count)]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _MockServer
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        is_api = parts.path in API_PATHS
+        server.count("api_requests" if is_api else "image_requests")
+        if server.latency:
+            time.sleep(server.latency)
+        if random.random() < server.error_rate:
+            server.count("errors")
+            self._send(server.error_status, b"", "text/plain")
+            return
+        if parts.path == API_PATHS[0]:
+            body = {"images": [self._nekos_image(i) for i in server.next_ids(int(query.get("count", 1)))]}
+        elif parts.path == API_PATHS[1]:
+            body = {"items": [self._waifu_item(i) for i in server.next_ids(int(query.get("PageSize", 1)))]}
+        elif parts.path == API_PATHS[2]:
+            body = [self._danbooru_post(i) for i in server.next_ids(int(query.get("limit", 20)))]
+        else:
+            self._send(200, server.image, "image/png")
+            return
+        self._send(200, json.dumps(body).encode("utf-8"), "application/json")
+
+    def _nekos_image(self, image_id: int) -> dict:
+        return {"id": f"n{image_id}", "nsfw": False, "artist": "benchmark", "tags": []}
+
+    def _waifu_item(self, image_id: int) -> dict:
+        return {"id": image_id, "url": f"https://cdn.waifu.im/{image_id}.png", "isNsfw": False}
+
+    def _danbooru_post(self, post_id: int) -> dict:
+        server = self.server
+        tags = ["benchmark"]
+        if random.random() < server.forbidden_rate:
+            tags.append(random.choice(server.forbidden_tags))
+        side = server.image_side
+        return {
+            "id": post_id,
+            "file_url": f"https://cdn.donmai.us/original/{post_id}.png",
+            "large_file_url": f"https://cdn.donmai.us/sample/{post_id}.png",
+            "file_ext": "png",
+            "file_size": len(server.image),
+            "image_width": side,
+            "image_height": side,
+            "tag_string": " ".join(tags),
+            "tag_string_artist": "benchmark",
+            "rating": "g",
+        }
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        for offset in range(0, len(body), WRITE_CHUNK):
+            chunk = body[offset:offset + WRITE_CHUNK]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+        self.server.count("bytes_sent", len(body))
+
+    def log_message(self, *args):
+        pass
+
+
+def _mock_client(port: int):
+    """HttpClient whose requests all go to the mock server, without rate limits."""
+    from requests.adapters import HTTPAdapter
+    from src.http_client import HttpClient
+    from src.rate_limit import RateLimiter
+
+    class _RedirectAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            # https://host/path -> http://127.0.0.1:port/host/path, the server dispatches on the path
+            parts = urlsplit(request.url)
+            query = f"?{parts.query}" if parts.query else ""
+            request.url = f"http://127.0.0.1:{port}/{parts.hostname}{parts.path}{query}"
+            return super().send(request, **kwargs)
+
+    http = HttpClient(limiter=RateLimiter(rates={}, default_rate=(1e6, 1e6)))
+    adapter = _RedirectAdapter(pool_connections=10, pool_maxsize=10)
+    http.session.mount("https://", adapter)
+    http.session.mount("http://", adapter)
+    return http
+
+
+def _make_fetcher(http, cache, decode: bool):
+    """Returns fetch(url) -> downloaded bytes, decoding through load_image_with_callback when decode is set."""
+    if not decode:
+        from src.download import download
+        return lambda url: download(url, http)
+
+    import gi
+    gi.require_version("GdkPixbuf", "2.0")
+    from gi.repository import GLib
+    from src.executor import FetchExecutor
+    from src.image_loader import load_image_with_callback
+
+    # Callbacks arrive through GLib.idle_add, something has to run the main context
+    loop = GLib.MainLoop()
+    threading.Thread(target=loop.run, daemon=True).start()
+    executor = FetchExecutor()
+
+    def _fetch(url):
+        done = threading.Event()
+        result = {}
+
+        def _on_loaded(loader, content):
+            result["content"] = content
+            done.set()
+
+        def _on_error(error):
+            result["error"] = error
+            done.set()
+
+        load_image_with_callback(url, _on_loaded, _on_error, http=http, cache=cache, executor=executor)
+        done.wait()
+        if "error" in result:
+            raise result["error"]
+        return result["content"]
+    return _fetch
+
+
+def _child(source_id: str, port: int, images: int, decode: bool) -> None:
+    from src.image_cache import ImageCache
+    from src.seen_index import SeenIndex
+    from src.sources import AVAILABLE_SOURCES
+    from src.types import NSFWOption
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        http = _mock_client(port)
+        # Nothing is served from disk, every image is a real download
+        cache = ImageCache(directory=os.path.join(directory, "images"), max_bytes=0)
+        seen = SeenIndex(path=os.path.join(directory, "seen.bin"))
+        api = AVAILABLE_SOURCES[source_id].create(settings=None, http=http, cache=cache, seen=seen)
+        fetch = _make_fetcher(http, cache, decode)
+
+        first_image = None
+        shown = failures = size = 0
+        for _ in range(images):
+            try:
+                url, _info = api.get_image_url_with_info(NSFWOption.BLOCK_NSFW)
+                if not url:
+                    raise IOError("No image URL")
+                size += len(fetch(url))
+            except Exception as e:
+                print(f"{source_id}: {e}", file=sys.stderr)
+                failures += 1
+                continue
+            shown += 1
+            if first_image is None:
+                first_image = time.perf_counter() - start
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - start_cpu
+        megabytes = size / (1024 * 1024)
+        print(json.dumps({
+            "images": shown,
+            "failures": failures,
+            "time_to_first_image_ms": first_image * 1000 if first_image is not None else None,
+            "images_per_s": shown / wall if wall else None,
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "cpu_ms_per_mb": cpu * 1000 / megabytes if megabytes else None,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024,
+            "downloaded_mb": megabytes,
+        }))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the image sources against a local mock server")
+    parser.add_argument("--sources", default=",".join(SOURCES), help="comma separated source ids")
+    parser.add_argument("--images", type=int, default=50, help="images to show per source")
+    parser.add_argument("--latency-ms", type=float, default=20, help="delay before every response")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0, help="per connection, 0 for unlimited")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--forbidden-rate", type=float, default=0.1,
+                        help="fraction of Danbooru posts carrying a censored tag")
+    parser.add_argument("--image-kb", type=float, default=200)
+    parser.add_argument("--decode", action="store_true", help="decode through load_image_with_callback (needs gi)")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--child", choices=SOURCES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.port, args.images, args.decode)
+        return
+
+    server = _MockServer(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("child", "port", "output")},
+        "timestamp": time.time(),
+        "sources": {},
+    }
+    for source_id in args.sources.split(","):
+        server.reset()
+        command = [sys.executable, __file__, "--child", source_id, "--port", str(server.server_address[1]),
+                   "--images", str(args.images)]
+        if args.decode:
+            command.append("--decode")
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        # The sources print their own messages, the result is the last line
+        result = json.loads(output.strip().splitlines()[-1])
+        counters = server.reset()
+        images = result["images"] or 1
+        result.update(counters)
+        result["requests_per_image"] = (counters["api_requests"] + counters["image_requests"]) / images
+        result["api_requests_per_image"] = counters["api_requests"] / images
+        results["sources"][source_id] = result
+    server.shutdown()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
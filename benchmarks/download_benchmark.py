@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# download_benchmark.py
+#
+# Compares the old 1 KiB iter_content() download loop with src.download.
+# Every run happens in a fresh subprocess so ru_maxrss is the peak of that
+# run alone.
+#
+# Usage: python3 benchmarks/download_benchmark.py [--size-mb 20] [--runs 3] [--decode]
+
+import argparse
+import http.server
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    payload = b""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(size: int) -> http.server.ThreadingHTTPServer:
+    _Handler.payload = os.urandom(size)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _make_decoder(decode: bool):
+    if not decode:
+        return None
+    import gi
+    gi.require_version("GdkPixbuf", "2.0")
+    from gi.repository import GdkPixbuf
+    loader = GdkPixbuf.PixbufLoader()
+
+    def _write(chunk):
+        try:
+            loader.write(chunk if isinstance(chunk, bytes) else chunk.tobytes())
+        except Exception:
+            # Random payloads are not images, only the cost of feeding matters
+            pass
+    return _write
+
+
+def _legacy(url: str, decode: bool) -> int:
+    import requests
+    write = _make_decoder(decode)
+    data = bytearray()
+    response = requests.get(url, stream=True)
+    response.raise_for_status()
+    for chunk in response.iter_content(chunk_size=1024):
+        data.extend(chunk)
+        if write:
+            write(chunk)
+    return len(bytes(data))
+
+
+def _streaming(url: str, decode: bool) -> int:
+    from src.download import download
+    from src.http_client import HttpClient
+    return len(download(url, HttpClient(), on_chunk=_make_decoder(decode)))
+
+
+def _child(mode: str, url: str, decode: bool) -> None:
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    size = (_legacy if mode == "legacy" else _streaming)(url, decode)
+    result = {
+        "mode": mode,
+        "bytes": size,
+        "wall_s": time.perf_counter() - start,
+        "cpu_s": time.process_time() - start_cpu,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "baseline_rss_kb": baseline_rss,
+    }
+    print(json.dumps(result))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the legacy and streaming download paths")
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--decode", action="store_true", help="also feed a GdkPixbuf loader")
+    parser.add_argument("--child", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.url, args.decode)
+        return
+
+    server = _serve(int(args.size_mb * 1024 * 1024))
+    url = f"http://127.0.0.1:{server.server_address[1]}/image"
+    summary = {}
+    for mode in ("legacy", "streaming"):
+        runs = []
+        for _ in range(args.runs):
+            command = [sys.executable, __file__, "--child", mode, "--url", url]
+            if args.decode:
+                command.append("--decode")
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output))
+        megabytes = runs[0]["bytes"] / (1024 * 1024)
+        summary[mode] = {
+            "cpu_ms_per_mb": min(run["cpu_s"] for run in runs) * 1000 / megabytes,
+            "wall_ms_per_mb": min(run["wall_s"] for run in runs) * 1000 / megabytes,
+            "peak_rss_mb": max(run["peak_rss_kb"] for run in runs) / 1024,
+            "rss_growth_mb": max(run["peak_rss_kb"] - run["baseline_rss_kb"] for run in runs) / 1024,
+        }
+    server.shutdown()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
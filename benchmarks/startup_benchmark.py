@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# startup_benchmark.py
+#
+# Measures cold start: process start -> window mapped -> first image shown.
+# The app is started with CATGIRLDOWNLOADER_STARTUP_TRACE set and the
+# milestones it prints on stderr are collected, then it is killed.
+#
+# Usage: python3 benchmarks/startup_benchmark.py [--runs 5] [--timeout 30] [-- command...]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import threading
+import time
+
+EVENTS = ("window-mapped", "first-image-shown")
+
+
+def _run_once(command: list, timeout: float) -> dict:
+    env = dict(os.environ, CATGIRLDOWNLOADER_STARTUP_TRACE="1")
+    start = time.time()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    marks = {}
+    done = threading.Event()
+
+    def _read():
+        for line in process.stderr:
+            parts = line.split()
+            if len(parts) == 3 and parts[0] == "startup":
+                marks[parts[1]] = float(parts[2])
+                if all(event in marks for event in EVENTS):
+                    done.set()
+        done.set()
+
+    threading.Thread(target=_read, daemon=True).start()
+    done.wait(timeout)
+    process.kill()
+    process.wait()
+    return {event: (marks[event] - start) * 1000 for event in EVENTS if event in marks}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure time to first window and first image")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for every milestone")
+    parser.add_argument("command", nargs="*", default=["catgirldownloader"])
+    args = parser.parse_args()
+
+    runs = [_run_once(args.command, args.timeout) for _ in range(args.runs)]
+    summary = {"runs": runs}
+    for event in EVENTS:
+        times = [run[event] for run in runs if event in run]
+        if times:
+            summary[event] = {
+                "median_ms": statistics.median(times),
+                "min_ms": min(times),
+                "max_ms": max(times),
+                "missing": len(runs) - len(times),
+            }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,126 @@
 from abc import ABC, abstractmethod
-from typing import Any, Optional
-import requests
+from typing import Any, Hashable, Optional, Tuple
+import asyncio
+import threading
 from .types import NSFWOption
+from .http_client import HttpClient, get_default_client
+from .image_cache import ImageCache, get_default_cache
+from .record_buffer import RecordBuffer
+from .seen_index import SeenIndex, get_default_seen_index
+from .download import download
+from .metrics import get_default_metrics
+from .tracing import trace_span
+
+# Already seen records skipped in a row before settling for a repeat
+MAX_SEEN_SKIPS = 20
+
+
+class FetchedImage:
+    """An image picked and downloaded by fetch_next()."""
+
+    def __init__(self, url: str, info: Optional[dict], content: bytes) -> None:
+        self.url = url
+        self.info = info
+        self.content = content
+
 
 class BaseDownloaderAPI(ABC):
-    def __init__(self) -> None:
+    # Key of the source in AVAILABLE_SOURCES, metrics are labelled with it
+    source_id: Optional[str] = None
+
+    def __init__(self, http: Optional[HttpClient] = None, cache: Optional[ImageCache] = None,
+                 seen: Optional[SeenIndex] = None) -> None:
         self.endpoint: str = ""
+        # Hosts contacted by this source, used to warm up connections
+        self.hosts: list[str] = []
+        self.http: HttpClient = http if http else get_default_client()
+        self.cache: ImageCache = cache if cache else get_default_cache()
+        self.seen: SeenIndex = seen if seen else get_default_seen_index()
         self.info: Optional[dict[str, Any]] = None
+        # (width, height) in device pixels the image will be shown at, kept
+        # up to date by the window so sources can pick a fitting variant
+        self.display_size: Optional[Tuple[int, int]] = None
+        # get_image_url() stores its result in self.info, so callers on different
+        # threads (window refresh, prefetcher) must not interleave
+        self._fetch_lock = threading.Lock()
 
     @abstractmethod
     def get_image_url(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Optional[str]:
         pass
 
+    def get_image_url_with_info(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Tuple[Optional[str], Optional[dict]]:
+        """
+        Thread-safe variant of get_image_url() that also returns the info
+        dict describing the image.
+        """
+        source = self._metrics_source()
+        with self._fetch_lock, get_default_metrics().timer("metadata", source=source), \
+                trace_span("metadata", source=source):
+            url = self.get_image_url(nsfw_mode) if nsfw_mode is not None else self.get_image_url()
+            return url, self.info
+
+    def _metrics_source(self) -> str:
+        return self.source_id or type(self).__name__
+
+    def mark_seen(self, info: Optional[dict]) -> None:
+        """
+        Records the image described by info in the seen index, called once
+        it was shown or saved. Sources without image ids ignore it.
+        """
+
+    async def fetch_next_url(self, nsfw_mode: NSFWOption,
+                             limit: asyncio.Semaphore) -> Tuple[Optional[str], Optional[dict]]:
+        """
+        Async counterpart of get_image_url_with_info(). API calls run on the
+        loop's executor, at most as many at once as limit allows. self.info
+        is left alone so any number of calls can run at once.
+        """
+        # Runs the blocking version on a thread, BatchedDownloaderAPI fetches records instead
+        async with limit:
+            return await asyncio.to_thread(self.get_image_url_with_info, nsfw_mode)
+
+    async def fetch_next(self, nsfw_mode: NSFWOption, limit: asyncio.Semaphore,
+                         original: bool = False) -> Optional[FetchedImage]:
+        """
+        Picks the next image and downloads it. With original the full
+        original is requested instead of a variant sized for display.
+        """
+        url, info = await self.fetch_next_url(nsfw_mode, limit)
+        if not url:
+            return None
+        if original:
+            url = self.get_original_url(info) or url
+        async with limit:
+            content = await asyncio.to_thread(download, url, self.http)
+        return FetchedImage(url, info, content)
+
+    def get_original_url(self, info: Optional[dict] = None) -> Optional[str]:
+        """
+        Returns the URL of the full original when get_image_url() may have
+        returned a smaller variant for display, None otherwise.
+        Override this method if the source serves resized variants.
+        """
+        return None
+
+    def get_history_info(self, info: Optional[dict] = None) -> Optional[dict]:
+        """
+        Returns the part of info that get_artist(), get_link(),
+        get_original_url() and get_filename_suggestion() read, which is
+        what the history stores instead of the full API response.
+        Override this method if the source's info carries more than that.
+        """
+        return info if info else self.info
+
+    def get_query_key(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Hashable:
+        """
+        Returns a value identifying the query that would be made for nsfw_mode.
+        Images fetched under a different key must not be shown anymore.
+        Override this method if the source has additional query settings.
+        """
+        if isinstance(nsfw_mode, NSFWOption):
+            return nsfw_mode.value
+        return nsfw_mode
+
     @abstractmethod
     def get_artist(self, info: Optional[dict] = None) -> Optional[str]:
         pass
@@ -21,12 +130,16 @@ class BaseDownloaderAPI(ABC):
         pass
 
     def get_image(self, url: str) -> Optional[bytes]:
+        content = self.cache.get(url)
+        if content is not None:
+            return content
         try:
-            r = requests.get(url, timeout=20)
+            r = self.http.get(url, timeout=20)
             # The original implementations didn't check status code explicitly in get_image
             # but usually relied on the caller or just returned content.
             # We'll return content if successful, or None on error for safety.
             if r.status_code == 200:
+                self.cache.put(url, r.content)
                 return r.content
             return None
         except Exception as e:
@@ -56,3 +169,142 @@ class BaseDownloaderAPI(ABC):
             if app:
                 app.activate_action("preferences", None)
 
+
+class BatchedDownloaderAPI(BaseDownloaderAPI):
+    """
+    Source whose API returns many image records per call. Records are
+    buffered per query key by a RecordBuffer, refilled in the background,
+    and the async fetch_next_url() pops them without blocking the loop.
+    """
+    # Batches to fetch before giving up when every record gets filtered out
+    _max_attempts = 1
+    # Buffered records below which the next batch is fetched
+    _low_water = 10
+
+    def __init__(self, http: Optional[HttpClient] = None, cache: Optional[ImageCache] = None,
+                 seen: Optional[SeenIndex] = None) -> None:
+        super().__init__(http, cache, seen)
+        self._records = RecordBuffer(self._fetch_batch, low_water=self._low_water)
+
+    @abstractmethod
+    def _batch_request(self, key: Hashable) -> Tuple[str, Optional[dict]]:
+        """Returns the (url, params) of the API call fetching a batch of records for key."""
+
+    @abstractmethod
+    def _parse_batch(self, key: Hashable, data: Any) -> Optional[list]:
+        """Turns the decoded JSON of a batch into records, None if nothing usable came back."""
+
+    def _record_key(self, nsfw_mode: NSFWOption) -> Hashable:
+        """Returns the key records for nsfw_mode are buffered and fetched under."""
+        return self.get_query_key(nsfw_mode)
+
+    @abstractmethod
+    def _record_url(self, record: dict) -> Optional[str]:
+        """Returns the URL of the image of record."""
+
+    def _record_id(self, record: dict) -> Optional[Any]:
+        """Returns the id the source gives the image of record, None if it has none."""
+        return record.get("id")
+
+    def _seen_key(self, record: dict) -> Optional[str]:
+        record_id = self._record_id(record)
+        if record_id is None:
+            return None
+        return f"{self.hosts[0] if self.hosts else type(self).__name__}:{record_id}"
+
+    def _is_new(self, record: dict) -> bool:
+        """Whether the image of record was not shown before, checked before downloading anything."""
+        key = self._seen_key(record)
+        return key is None or key not in self.seen
+
+    def mark_seen(self, info: Optional[dict]) -> None:
+        record = self._info_record(info) if info else None
+        key = self._seen_key(record) if record else None
+        if key is not None:
+            self.seen.add(key)
+
+    def _record_info(self, record: dict) -> dict:
+        """Returns the info dict describing record, as stored in self.info."""
+        return record
+
+    def _info_record(self, info: dict) -> Optional[dict]:
+        """Inverse of _record_info(), returns the record info was made from."""
+        return info
+
+    def _fetch_batch(self, key: Hashable) -> Optional[list]:
+        url, params = self._batch_request(key)
+        metrics = get_default_metrics()
+        try:
+            with metrics.timer("api_request", source=self._metrics_source()), \
+                    trace_span("api_request", source=self._metrics_source(), url=url):
+                r = self.http.get(url, params=params, timeout=10)
+                if r.status_code != 200:
+                    metrics.increment("errors", stage="api_request", error=f"HTTP {r.status_code}",
+                                      source=self._metrics_source())
+                    return None
+                data = r.json()
+        except Exception as e:
+            print(e)
+            return None
+        metrics.observe("api_response", len(r.content), unit="bytes", source=self._metrics_source())
+        return self._counted_batch(self._parse_batch(key, data))
+
+    def _counted_batch(self, records: Optional[list]) -> Optional[list]:
+        if not records:
+            # Another batch gets fetched, e.g. when Danbooru filtered out every post
+            get_default_metrics().increment("empty_batches", source=self._metrics_source())
+        return records
+
+    async def _fetch_batch_async(self, key: Hashable, limit: asyncio.Semaphore) -> Optional[list]:
+        async with limit:
+            return await asyncio.to_thread(self._fetch_batch, key)
+
+    def _pop_record(self, nsfw_mode: NSFWOption, max_attempts: Optional[int] = None) -> Optional[dict]:
+        """Pops the next record whose image was not shown before."""
+        key = self._record_key(nsfw_mode)
+        attempts = max_attempts if max_attempts is not None else self._max_attempts
+        repeat = None
+        skipped = 0
+        for _ in range(MAX_SEEN_SKIPS):
+            record = self._records.pop(key, max_attempts=attempts)
+            if record is None:
+                break
+            if self._is_new(record):
+                self._record_skipped(skipped)
+                return record
+            repeat = repeat or record
+            skipped += 1
+        # Better show a repeat than nothing
+        if repeat is not None:
+            self._record_skipped(skipped - 1)
+        return repeat
+
+    def _record_skipped(self, count: int) -> None:
+        self.seen.record_skipped(count)
+        if count:
+            get_default_metrics().increment("seen_skips", count, source=self._metrics_source())
+
+    async def _pop_record_async(self, nsfw_mode: NSFWOption, limit: asyncio.Semaphore) -> Optional[dict]:
+        key = self._record_key(nsfw_mode)
+        repeat = None
+        skipped = 0
+        for _ in range(MAX_SEEN_SKIPS):
+            record = await self._records.pop_async(key, lambda key: self._fetch_batch_async(key, limit),
+                                                   max_attempts=self._max_attempts)
+            if record is None:
+                break
+            if self._is_new(record):
+                self._record_skipped(skipped)
+                return record
+            repeat = repeat or record
+            skipped += 1
+        if repeat is not None:
+            self._record_skipped(skipped - 1)
+        return repeat
+
+    async def fetch_next_url(self, nsfw_mode: NSFWOption,
+                             limit: asyncio.Semaphore) -> Tuple[Optional[str], Optional[dict]]:
+        record = await self._pop_record_async(nsfw_mode, limit)
+        if record is None:
+            return None, None
+        return self._record_url(record), self._record_info(record)
@@ -0,0 +1,72 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, Optional
+
+from .http_client import HttpClient, get_default_client
+
+
+class AsyncEngine:
+    """
+    Runs an asyncio event loop on one dedicated thread for the GUI.
+
+    Requests go through the shared HttpClient on the loop's default
+    executor, so they keep its connection pools, proxies and rate limits;
+    `limit` bounds how many run at once. Decoding uses the same executor.
+    Results are handed back to GTK with GLib.idle_add(), like the
+    FetchExecutor tasks do.
+    """
+
+    def __init__(self, http: Optional[HttpClient] = None, pool_maxsize: int = 10, workers: int = 2) -> None:
+        self.http = http if http else get_default_client()
+        self.loop = asyncio.new_event_loop()
+        # One thread per pooled connection plus some for decoding
+        self.loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+            pool_maxsize + workers, thread_name_prefix="async-worker"))
+        # Requests in flight at once, awaited by coroutines on this loop only
+        self.limit = asyncio.Semaphore(pool_maxsize)
+        self._thread = threading.Thread(target=self._run, name="async-engine", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_settings(cls, settings: Any, http: Optional[HttpClient] = None) -> "AsyncEngine":
+        value = settings.get_preference("http_pool_size") if settings else None
+        try:
+            pool_size = int(value) if value is not None else 10
+        except Exception:
+            pool_size = 10
+        return cls(http, pool_maxsize=max(1, pool_size))
+
+    def _run(self) -> None:
+        self.loop.run_forever()
+        self.loop.close()
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        """Schedules coroutine on the loop. Cancelling the returned future cancels it."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _stop(self) -> None:
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        # Lets the cancelled tasks run their cleanup before the loop goes away
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def shutdown(self) -> None:
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._stop(), self.loop)
+        self._thread.join(timeout=5)
+
+
+_default_engine: Optional[AsyncEngine] = None
+_default_lock = threading.Lock()
+
+
+def get_default_engine() -> AsyncEngine:
+    """Engine used by components that were not given one explicitly."""
+    global _default_engine
+    with _default_lock:
+        if _default_engine is None:
+            _default_engine = AsyncEngine()
+        return _default_engine
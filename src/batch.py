@@ -0,0 +1,190 @@
+# batch.py
+#
+# Copyright 2026 SilverOS
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Headless bulk downloads: `catgirldownloader batch --help`.
+# Must not import gi, directly or through the modules it uses.
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+from .types import NSFWOption
+from .sources import AVAILABLE_SOURCES
+from .http_client import HttpClient
+from .fileutils import atomic_write
+
+STATE_FILE = ".catgirldownloader-batch.json"
+
+NSFW_MODES = {
+    "block": NSFWOption.BLOCK_NSFW,
+    "only": NSFWOption.ONLY_NSFW,
+    "all": NSFWOption.SHOW_EVERYTHING,
+}
+
+
+class BatchDownloader:
+    """
+    Downloads `count` images from one source into a directory using
+    `jobs` concurrent downloads driven by an asyncio loop, the requests
+    themselves run on a thread each through the source's HttpClient.
+    Completed files are recorded in a state file so an interrupted run
+    can be resumed by running the same command again.
+    """
+
+    def __init__(self, api, nsfw_mode, count, output, jobs=4, max_skipped=50):
+        self.api = api
+        self.nsfw_mode = nsfw_mode
+        self.count = count
+        self.output = output
+        self.jobs = jobs
+        # Failed downloads and duplicates, too many of them ends the run
+        self.max_skipped = max_skipped
+        self.state_file = os.path.join(output, STATE_FILE)
+        self.completed = []
+        self.bytes = 0
+        self.skipped = 0
+        self._claimed = 0
+        self._in_progress = set()
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Ignoring unreadable state file: {e}", file=sys.stderr)
+            return
+        # Files deleted since the last run are downloaded again
+        self.completed = [name for name in state.get("completed", [])
+                          if os.path.exists(os.path.join(self.output, name))]
+
+    def _save_state(self):
+        state = {"completed": self.completed}
+        atomic_write(self.state_file, json.dumps(state).encode("utf-8"))
+
+    def _claim(self):
+        if self._claimed + len(self.completed) >= self.count or self.skipped >= self.max_skipped:
+            return False
+        self._claimed += 1
+        return True
+
+    def _release(self, filename=None, size=0):
+        self._claimed -= 1
+        if not filename:
+            self.skipped += 1
+        else:
+            self.completed.append(filename)
+            self.bytes += size
+            self._save_state()
+
+    async def _worker(self):
+        while self._claim():
+            try:
+                filename, size = await self._download_one()
+            except Exception as e:
+                print(f"\nError downloading image: {e}", file=sys.stderr)
+                self._release()
+                continue
+            self._release(filename, size)
+
+    async def _download_one(self):
+        # Batch downloads are for keeping, always get the full original
+        image = await self.api.fetch_next(self.nsfw_mode, self._limit, original=True)
+        if image is None:
+            return None, 0
+        extension = os.path.splitext(urlsplit(image.url).path)[1].lstrip(".") or None
+        filename = self.api.get_filename_suggestion(extension, image.info)
+        path = os.path.join(self.output, filename)
+        if filename in self.completed or filename in self._in_progress or os.path.exists(path):
+            # Random endpoints repeat themselves, don't count duplicates
+            return None, 0
+        self._in_progress.add(filename)
+        try:
+            await asyncio.to_thread(atomic_write, path, image.content, public=True)
+        finally:
+            self._in_progress.discard(filename)
+        self.api.mark_seen(image.info)
+        return filename, len(image.content)
+
+    def _print_progress(self, start, final=False):
+        elapsed = max(time.monotonic() - start, 1e-6)
+        done = len(self.completed)
+        size = self.bytes
+        line = (f"\r{done}/{self.count} images, {size / 1048576:.1f} MB, "
+                f"{(done - self._initial) / elapsed:.2f} images/s, {size / 1048576 / elapsed:.2f} MB/s, "
+                f"{self.skipped} skipped")
+        print(line, end="\n" if final else "", file=sys.stderr, flush=True)
+
+    async def _run(self):
+        start = time.monotonic()
+        self._limit = asyncio.Semaphore(self.jobs)
+        # Every job may be blocked in a request while another file is written
+        asyncio.get_running_loop().set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(self.jobs + 2, thread_name_prefix="batch"))
+        workers = asyncio.gather(*[self._worker() for _ in range(self.jobs)])
+        while not workers.done():
+            await asyncio.wait([workers], timeout=0.5)
+            self._print_progress(start)
+        self._print_progress(start, final=True)
+        self.api.seen.close()
+        return 0 if len(self.completed) >= self.count else 1
+
+    def run(self):
+        os.makedirs(self.output, exist_ok=True)
+        self._initial = len(self.completed)
+        if self._initial:
+            print(f"Resuming, {self._initial} images already downloaded", file=sys.stderr)
+        try:
+            return asyncio.run(self._run())
+        except KeyboardInterrupt:
+            print("\nInterrupted, run the same command again to resume", file=sys.stderr)
+            return 130
+
+
+def main(argv):
+    """Entry point of `catgirldownloader batch`."""
+    parser = argparse.ArgumentParser(prog="catgirldownloader batch",
+                                     description="Download many images without opening the app.")
+    parser.add_argument("--source", choices=list(AVAILABLE_SOURCES), default=next(iter(AVAILABLE_SOURCES)))
+    parser.add_argument("--nsfw", choices=list(NSFW_MODES), default="block",
+                        help="block NSFW images, download only NSFW images or everything")
+    parser.add_argument("--tags", default="", help="Danbooru search tags, separated by spaces")
+    parser.add_argument("-n", "--count", type=int, default=10, help="number of images to download")
+    parser.add_argument("-o", "--output", default=".", help="directory to save the images in")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="concurrent downloads, each one uses a thread while its request runs")
+    args = parser.parse_args(argv)
+
+    jobs = max(1, args.jobs)
+    http = HttpClient(pool_connections=jobs, pool_maxsize=jobs)
+    api = AVAILABLE_SOURCES[args.source].create(http=http)
+    if args.tags:
+        if not hasattr(api, "set_tags"):
+            parser.error(f"--tags is not supported by the {args.source} source")
+        api.set_tags(args.tags)
+
+    downloader = BatchDownloader(api, NSFW_MODES[args.nsfw], args.count, args.output, jobs)
+    return downloader.run()
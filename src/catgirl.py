@@ -1,38 +1,65 @@
-import requests
-import json
-from typing import Optional
+from typing import Any, Optional, Tuple
 
 from .types import NSFWOption
-from .api_base import BaseDownloaderAPI
+from .api_base import BatchedDownloaderAPI
+from .http_client import HttpClient
+from .image_cache import ImageCache
+from .seen_index import SeenIndex
 
-class CatgirlDownloaderAPI(BaseDownloaderAPI):
-    def __init__(self, settings=None) -> None:
-        super().__init__()
+# Images requested per API call and buffered images that trigger a refill
+_BATCH_SIZE = 50
+_LOW_WATER_MARK = 10
+
+class CatgirlDownloaderAPI(BatchedDownloaderAPI):
+    _low_water = _LOW_WATER_MARK
+    source_id = "catgirl"
+
+    def __init__(self, settings=None, http: Optional[HttpClient] = None, cache: Optional[ImageCache] = None,
+                 seen: Optional[SeenIndex] = None) -> None:
+        super().__init__(http, cache, seen)
         self.endpoint = "https://nekos.moe/api/v1/random/image"
+        self.hosts = ["nekos.moe"]
 
-    def get_random_image_id(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Optional[str]:
-        try:
-            url = self.endpoint
-            # Handle both Enum and string input
-            if nsfw_mode == NSFWOption.ONLY_NSFW or nsfw_mode == NSFWOption.ONLY_NSFW.value:
-                url += "?nsfw=true"
-            elif nsfw_mode == NSFWOption.BLOCK_NSFW or nsfw_mode == NSFWOption.BLOCK_NSFW.value:
-                url += "?nsfw=false"
-
-            r = requests.get(url, timeout=10)
-            if r.status_code != 200:
-                return None
-        except Exception as e:
-            print(e)
-            return None
-        
+    def _record_key(self, nsfw_mode: NSFWOption) -> Optional[bool]:
+        # Handle both Enum and string input
+        nsfw = None
+        if nsfw_mode == NSFWOption.ONLY_NSFW or nsfw_mode == NSFWOption.ONLY_NSFW.value:
+            nsfw = True
+        elif nsfw_mode == NSFWOption.BLOCK_NSFW or nsfw_mode == NSFWOption.BLOCK_NSFW.value:
+            nsfw = False
+        return nsfw
+
+    def _batch_request(self, nsfw: Optional[bool]) -> Tuple[str, dict]:
+        params = {"count": _BATCH_SIZE}
+        if nsfw is not None:
+            params["nsfw"] = "true" if nsfw else "false"
+        return self.endpoint, params
+
+    def _parse_batch(self, nsfw: Optional[bool], data: Any) -> Optional[list]:
         try:
-            data = json.loads(r.text)
-            self.info = data
-            return data['images'][0]['id']
+            images = [image for image in data['images'] if image.get('id')]
+            return images if images else None
         except Exception:
             return None
 
+    def _record_url(self, image: dict) -> str:
+        return "https://nekos.moe/image/" + image['id']
+
+    def _record_info(self, image: dict) -> dict:
+        # Keep the shape of a single-image API response for get_artist() and friends
+        return {'images': [image]}
+
+    def _info_record(self, info: dict) -> Optional[dict]:
+        images = info.get('images')
+        return images[0] if images else None
+
+    def get_random_image_id(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Optional[str]:
+        image = self._pop_record(nsfw_mode)
+        if image is None:
+            return None
+        self.info = self._record_info(image)
+        return image['id']
+
     def get_image_url(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Optional[str]:
         image_id = self.get_random_image_id(nsfw_mode)
         if image_id:
@@ -57,6 +84,14 @@ class CatgirlDownloaderAPI(BaseDownloaderAPI):
         except Exception:
             return None
 
+    def get_history_info(self, info: Optional[dict] = None) -> Optional[dict]:
+        data = info if info else self.info
+        try:
+            image = data['images'][0]
+        except Exception:
+            return None
+        return {'images': [{key: image[key] for key in ('id', 'artist') if key in image}]}
+
     def get_filename_suggestion(self, extension: Optional[str], info: Optional[dict] = None) -> str:
         data = info if info else self.info
         if not data:
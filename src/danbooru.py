@@ -1,30 +1,64 @@
-import requests
-import json
 import time
 import base64
-from typing import Optional, Any
+import functools
+from typing import Optional, Any, Hashable, Tuple
 
 from .types import NSFWOption
-from .api_base import BaseDownloaderAPI
+from .api_base import BatchedDownloaderAPI
+from .http_client import HttpClient
+from .image_cache import ImageCache
+from .seen_index import SeenIndex
+from .metrics import get_default_metrics
 
-# TODO: Surely, there must be a better way to encode these. I don't think listing the tags explicitly would be a good idea. --PCBoy
-_FORBIDDEN_TAG_1 = base64.b64decode('c2hvdGE='.encode('utf-8')).decode('utf-8')
-_FORBIDDEN_TAG_2 = base64.b64decode('bG9saQ=='.encode('utf-8')).decode('utf-8')
 
-class DanbooruDownloaderAPI(BaseDownloaderAPI):
-    def __init__(self, settings=None) -> None:
-        super().__init__()
+# TODO: Surely, there must be a better way to encode these. I don't think listing the tags explicitly would be a good idea. --PCBoy
+@functools.lru_cache(maxsize=None)
+def _forbidden_tags() -> tuple:
+    # Decoded on first use instead of at import time
+    return tuple(base64.b64decode(tag.encode('utf-8')).decode('utf-8') for tag in ('c2hvdGE=', 'bG9saQ=='))
+
+
+# Formats GdkPixbuf can decode; videos and zips are skipped
+_SUPPORTED_EXTENSIONS = ("jpg", "jpeg", "png", "gif", "webp")
+# Seconds a display download should take at the measured throughput; larger
+# variants are skipped on links too slow for that
+_DISPLAY_TIME_BUDGET = 2.0
+# Variants below this width look bad even in a small window
+_MIN_VARIANT_WIDTH = 720
+# Posts requested per API call and buffered posts that trigger a refill
+_BATCH_SIZE = 100
+_LOW_WATER_MARK = 20
+
+class DanbooruDownloaderAPI(BatchedDownloaderAPI):
+    _low_water = _LOW_WATER_MARK
+    # Whole batches can be filtered out, try a few before giving up
+    _max_attempts = 5
+    source_id = "danbooru"
+
+    def __init__(self, settings=None, http: Optional[HttpClient] = None, cache: Optional[ImageCache] = None,
+                 seen: Optional[SeenIndex] = None) -> None:
+        super().__init__(http, cache, seen)
         self.endpoint = "https://danbooru.donmai.us"
+        self.hosts = ["danbooru.donmai.us", "cdn.donmai.us"]
         self._settings = settings
         self._load_tags()
         self._settings_window = None
+        if hasattr(settings, "connect"):
+            # Pick up edits made elsewhere, e.g. to config.json
+            settings.connect("changed::danbooru_tags", lambda *_: self._load_tags())
 
     def _load_tags(self) -> None:
+        self.tags = ""
         if self._settings:
             self.tags = self._settings.get_preference("danbooru_tags") or ""
 
     def set_tags(self, tags: str) -> None:
-        self.tags = tags
+        """Sets the search tags, dropping the ones Danbooru censors."""
+        tagcheck = tags.lower().split()
+        for forbidden in _forbidden_tags():
+            while forbidden in tagcheck:
+                tagcheck.remove(forbidden)
+        self.tags = ' '.join(tagcheck)
 
     def get_tags(self) -> str:
         return self.tags
@@ -45,45 +79,110 @@ class DanbooruDownloaderAPI(BaseDownloaderAPI):
             return rating_tag
         return tags
 
-    def get_random_post(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW, max_retries: int = 5) -> Optional[dict]:
-        for attempt in range(max_retries):
-            try:
-                tags = self._build_tags_query(nsfw_mode)
-                params = {
-                    "limit": 1,
-                    "random": "true"
-                }
-                if tags:
-                    params["tags"] = tags
-                r = requests.get(f"{self.endpoint}/posts.json", params=params, timeout=10)
-                if r.status_code != 200:
-                    return None
-            except Exception as e:
-                print(e)
-                return None
-            try:
-                data = json.loads(r.text)
-                if isinstance(data, list) and len(data) > 0:
-                    post = data[0]
-                    post_tags = post.get('tag_string', '').split()
-                    if _FORBIDDEN_TAG_1 in post_tags or _FORBIDDEN_TAG_2 in post_tags:
-                        print(f'Attempt {attempt + 1}: Forbidden tags in post, retrying...')
-                        continue
-
-                    self.info = post
-                    return post
-                return None
-            except Exception:
-                return None
-        print(f'Could not find suitable post after {max_retries} attempts')
-        return None
+    def get_query_key(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Hashable:
+        return self._build_tags_query(nsfw_mode)
+
+    def _is_suitable_post(self, post: Any) -> bool:
+        if not isinstance(post, dict):
+            return False
+        if not post.get("file_url"):
+            return False
+        if post.get("is_banned") or post.get("is_deleted"):
+            return False
+        if (post.get("file_ext") or "").lower() not in _SUPPORTED_EXTENSIONS:
+            return False
+        post_tags = post.get('tag_string', '').split()
+        return not any(forbidden in post_tags for forbidden in _forbidden_tags())
+
+    def _batch_request(self, tags: str) -> Tuple[str, dict]:
+        params = {
+            "limit": _BATCH_SIZE,
+            "random": "true"
+        }
+        if tags:
+            params["tags"] = tags
+        return f"{self.endpoint}/posts.json", params
+
+    def _parse_batch(self, tags: str, data: Any) -> Optional[list]:
+        if not isinstance(data, list) or not data:
+            # Nothing matches the query, fetching again won't change that
+            return None
+        posts = [post for post in data if self._is_suitable_post(post)]
+        if len(posts) < len(data):
+            print(f'Filtered out {len(data) - len(posts)} of {len(data)} posts')
+            get_default_metrics().increment("records_filtered", len(data) - len(posts), source=self.source_id)
+        return posts
+
+    def get_random_post(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW, max_retries: int = _max_attempts) -> Optional[dict]:
+        post = self._pop_record(nsfw_mode, max_retries)
+        if post is None:
+            print(f'Could not find suitable post after {max_retries} attempts')
+            return None
+        self.info = post
+        return post
+
+    def _get_variants(self, post: dict) -> list:
+        """Returns displayable (width, height, url) variants of post, smallest first."""
+        variants = []
+        media_asset = post.get("media_asset") or {}
+        for variant in media_asset.get("variants") or []:
+            width, height, url = variant.get("width"), variant.get("height"), variant.get("url")
+            if not (width and height and url):
+                continue
+            if (variant.get("file_ext") or "").lower() not in _SUPPORTED_EXTENSIONS:
+                continue
+            variants.append((width, height, url))
+        original_url = post.get("file_url")
+        if post.get("image_width") and post.get("image_height") and original_url \
+                and original_url not in [url for _w, _h, url in variants]:
+            variants.append((post["image_width"], post["image_height"], original_url))
+        variants.sort()
+        return variants
+
+    def _pick_variant(self, post: dict) -> Optional[str]:
+        variants = self._get_variants(post)
+        if not variants or not self.display_size:
+            return post.get("large_file_url") or post.get("file_url")
+
+        width, height, _url = variants[-1]
+        display_width, display_height = self.display_size
+        # Size the original would be shown at, never upscaled
+        scale = min(display_width / width, display_height / height, 1)
+        needed_width = width * scale
+
+        candidates = [v for v in variants if v[0] >= _MIN_VARIANT_WIDTH or v is variants[-1]]
+        covering = [v for v in candidates if v[0] >= needed_width]
+        choice = covering[0] if covering else candidates[-1]
+
+        throughput = self.http.throughput
+        file_size = post.get("file_size")
+        if throughput and file_size:
+            # Assume bytes scale with pixel count, good enough to rank variants
+            def _estimated_seconds(variant):
+                return file_size * (variant[0] * variant[1]) / (width * height) / throughput
+
+            while _estimated_seconds(choice) > _DISPLAY_TIME_BUDGET:
+                smaller = [v for v in candidates if v[0] < choice[0]]
+                if not smaller:
+                    break
+                choice = smaller[-1]
+        return choice[2]
+
+    def _record_url(self, post: dict) -> Optional[str]:
+        return self._pick_variant(post)
 
     def get_image_url(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Optional[str]:
         post = self.get_random_post(nsfw_mode)
         if post:
-            return post.get("file_url")
+            return self._pick_variant(post)
         return None
 
+    def get_original_url(self, info: Optional[dict] = None) -> Optional[str]:
+        data = info if info else self.info
+        if not data:
+            return None
+        return data.get("file_url")
+
     def get_artist(self, info: Optional[dict] = None) -> Optional[str]:
         data = info if info else self.info
         if not data:
@@ -108,6 +207,12 @@ class DanbooruDownloaderAPI(BaseDownloaderAPI):
         except Exception:
             return None
 
+    def get_history_info(self, info: Optional[dict] = None) -> Optional[dict]:
+        data = info if info else self.info
+        if not data:
+            return None
+        return {key: data[key] for key in ("id", "tag_string_artist", "file_url") if key in data}
+
     def get_filename_suggestion(self, extension: Optional[str], info: Optional[dict] = None) -> str:
         data = info if info else self.info
         if not data:
@@ -177,18 +282,13 @@ class DanbooruDownloaderAPI(BaseDownloaderAPI):
         window.present()
 
     def _on_tags_changed(self, entry: Any, window: Any) -> None:
-        tagcheck = entry.get_text().lower().split()
-        while _FORBIDDEN_TAG_1 in tagcheck:
-            tagcheck.remove(_FORBIDDEN_TAG_1)
-        while _FORBIDDEN_TAG_2 in tagcheck:
-            tagcheck.remove(_FORBIDDEN_TAG_2)
-        self.tags = ' '.join(tagcheck)
+        self.set_tags(entry.get_text())
         if self._settings:
             self._settings.set_preference("danbooru_tags", self.tags)
 
     def _on_prefs_close(self, text: Any, parent: Any) -> None:
         tagcheck = text.get_text().lower().split()
-        if _FORBIDDEN_TAG_1 in tagcheck or _FORBIDDEN_TAG_2 in tagcheck:
+        if any(forbidden in tagcheck for forbidden in _forbidden_tags()):
             self.open_forbid_tag_notif(parent)
 
     def open_forbid_tag_notif(self, parent: Any) -> None:
@@ -0,0 +1,103 @@
+import time
+from typing import Any, Callable, Optional
+
+from .http_client import HttpClient, get_default_client
+from .executor import CancelledError, FetchToken
+from .tracing import get_tracer
+
+# Reads start small so the decoder sees the header early, then grow while
+# the socket keeps filling them
+MIN_READ_SIZE = 64 * 1024
+MAX_READ_SIZE = 1024 * 1024
+
+
+def download(url: str, http: Optional[HttpClient] = None, token: Optional[FetchToken] = None,
+             on_chunk: Optional[Callable[[memoryview], Any]] = None,
+             on_progress: Optional[Callable[[int, Optional[int]], Any]] = None) -> bytearray:
+    """
+    Downloads url into a single buffer.
+
+    When the server sends Content-Length the buffer is allocated once and
+    filled in place with readinto(). on_chunk receives a memoryview of every
+    newly filled region, valid until the next read. The returned bytearray is
+    the download buffer itself, not a copy. on_progress receives the number
+    of bytes received so far and the total, None if unknown, after each read.
+    """
+    http = http if http else get_default_client()
+    response = http.get(url, stream=True)
+    try:
+        if token:
+            token.register(response)
+        response.raise_for_status()
+
+        start = time.monotonic()
+        length = response.headers.get("Content-Length")
+        encoding = response.headers.get("Content-Encoding", "identity")
+        if length and length.isdigit() and encoding == "identity":
+            buffer = _read_sized(response, int(length), token, on_chunk, on_progress)
+        else:
+            buffer = _read_unsized(response, token, on_chunk, on_progress)
+        http.record_throughput(len(buffer), time.monotonic() - start)
+        return buffer
+    except Exception as e:
+        if token and token.cancelled:
+            # Reads fail in all sorts of ways once the socket is closed under them
+            raise CancelledError() from e
+        raise
+    finally:
+        if token:
+            token.unregister(response)
+        response.close()
+
+
+def _read_sized(response: Any, length: int, token: Optional[FetchToken],
+                on_chunk: Optional[Callable[[memoryview], Any]],
+                on_progress: Optional[Callable[[int, Optional[int]], Any]]) -> bytearray:
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    raw = response.raw
+    offset = 0
+    read_size = MIN_READ_SIZE
+    tracer = get_tracer()
+    while offset < length:
+        if token:
+            token.check()
+        end = min(offset + read_size, length)
+        start = time.monotonic()
+        count = raw.readinto(view[offset:end])
+        if tracer:
+            tracer.complete("read", start, bytes=count)
+        if not count:
+            break
+        if on_chunk:
+            on_chunk(view[offset:offset + count])
+        if offset + count == end and read_size < MAX_READ_SIZE:
+            read_size *= 2
+        offset += count
+        if on_progress:
+            on_progress(offset, length)
+    view.release()
+    if offset < length:
+        raise IOError(f"Connection closed after {offset} of {length} bytes")
+    return buffer
+
+
+def _read_unsized(response: Any, token: Optional[FetchToken],
+                  on_chunk: Optional[Callable[[memoryview], Any]],
+                  on_progress: Optional[Callable[[int, Optional[int]], Any]]) -> bytearray:
+    # Without a trusted length fall back to requests' decoding iterator
+    buffer = bytearray()
+    tracer = get_tracer()
+    start = time.monotonic()
+    for chunk in response.iter_content(chunk_size=MAX_READ_SIZE):
+        if tracer:
+            tracer.complete("read", start, bytes=len(chunk))
+        if token:
+            token.check()
+        buffer += chunk
+        if on_chunk:
+            on_chunk(memoryview(chunk))
+        if on_progress:
+            on_progress(len(buffer), None)
+        start = time.monotonic()
+    return buffer
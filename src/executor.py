@@ -0,0 +1,168 @@
+import itertools
+import queue
+import threading
+from typing import Any, Callable, Optional
+
+# Lower values run first
+PRIORITY_USER = 0
+# On screen but not asked for, like gallery thumbnails
+PRIORITY_VISIBLE = 5
+PRIORITY_BACKGROUND = 10
+
+
+class CancelledError(Exception):
+    """Raised inside a task whose token has been cancelled."""
+
+
+class FetchToken:
+    """
+    Identifies one generation of work. Cancelling it closes the responses
+    registered on it so blocked reads return immediately.
+    """
+
+    def __init__(self) -> None:
+        self._cancelled = False
+        self._responses: list = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+            responses, self._responses = self._responses, []
+        for response in responses:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def register(self, response: Any) -> None:
+        """Ties response to this token, closing it right away if already cancelled."""
+        with self._lock:
+            if not self._cancelled:
+                self._responses.append(response)
+                return
+        response.close()
+        raise CancelledError()
+
+    def unregister(self, response: Any) -> None:
+        with self._lock:
+            if response in self._responses:
+                self._responses.remove(response)
+
+    def check(self) -> None:
+        if self._cancelled:
+            raise CancelledError()
+
+
+class FetchExecutor:
+    """
+    Fixed-size pool of worker threads shared by all fetches.
+
+    Tasks run in priority order. Each channel (for example "display" or a
+    prefetcher) has a current token; starting a new generation on a channel
+    cancels the previous one.
+    """
+
+    def __init__(self, workers: int = 4) -> None:
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._channels: dict = {}
+        # Tasks queued or running, per priority
+        self._active: dict = {}
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"fetch-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> "FetchExecutor":
+        value = settings.get_preference("fetch_workers") if settings else None
+        try:
+            workers = int(value) if value is not None else 4
+        except Exception:
+            workers = 4
+        return cls(workers=max(1, workers))
+
+    def new_generation(self, channel: str) -> FetchToken:
+        token = FetchToken()
+        with self._lock:
+            previous = self._channels.get(channel)
+            self._channels[channel] = token
+        if previous:
+            previous.cancel()
+        return token
+
+    def cancel(self, channel: str) -> None:
+        with self._lock:
+            token = self._channels.pop(channel, None)
+        if token:
+            token.cancel()
+
+    def submit(self, func: Callable, *args: Any, priority: int = PRIORITY_BACKGROUND,
+               token: Optional[FetchToken] = None) -> FetchToken:
+        """Queues func(*args, token) and returns the token it runs under."""
+        if token is None:
+            token = FetchToken()
+        if self._shutdown:
+            token.cancel()
+            return token
+        with self._lock:
+            self._active[priority] = self._active.get(priority, 0) + 1
+        self._queue.put((priority, next(self._counter), func, args, token))
+        return token
+
+    def busy(self, priority: int = PRIORITY_USER) -> bool:
+        """Whether tasks of priority or more urgent ones are queued or running."""
+        with self._lock:
+            return any(count for task_priority, count in self._active.items() if task_priority <= priority)
+
+    def _worker(self) -> None:
+        while True:
+            priority, _seq, func, args, token = self._queue.get()
+            if func is None or self._shutdown:
+                return
+            try:
+                if not token.cancelled:
+                    func(*args, token)
+            except CancelledError:
+                pass
+            except Exception as e:
+                print(f"Error in fetch task: {e}")
+            finally:
+                with self._lock:
+                    self._active[priority] -= 1
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Cancels all work and stops the workers."""
+        with self._lock:
+            self._shutdown = True
+            tokens = list(self._channels.values())
+            self._channels.clear()
+        for token in tokens:
+            token.cancel()
+        # Sentinels sort after every queued task
+        for _ in self._threads:
+            self._queue.put((float("inf"), next(self._counter), None, (), None))
+        if wait:
+            for thread in self._threads:
+                thread.join(timeout=5)
+
+
+_default_executor: Optional[FetchExecutor] = None
+_default_lock = threading.Lock()
+
+
+def get_default_executor() -> FetchExecutor:
+    """Executor used by components that were not given one explicitly."""
+    global _default_executor
+    with _default_lock:
+        if _default_executor is None:
+            _default_executor = FetchExecutor()
+        return _default_executor
@@ -0,0 +1,69 @@
+import os
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from .download import download
+from .executor import FetchExecutor, FetchToken, PRIORITY_BACKGROUND
+from .fileutils import atomic_copy, atomic_write
+from .http_client import HttpClient
+from .image_cache import ImageCache
+
+
+class ExportJob:
+    """
+    Writes a list of images into a directory, several at once on the
+    executor's workers. Images still in the cache are copied by the kernel
+    straight from the cached file, the others are downloaded.
+
+    on_progress(done, failed, total) is called from the workers after each image.
+    """
+
+    def __init__(self, entries: List[Tuple[str, str]], directory: str, cache: ImageCache, http: HttpClient,
+                 executor: FetchExecutor, on_progress: Optional[Callable[[int, int, int], None]] = None) -> None:
+        # (url, file name) pairs
+        self.entries = entries
+        self.directory = directory
+        self.cache = cache
+        self.http = http
+        self.executor = executor
+        self.on_progress = on_progress
+        self.done = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._token = FetchToken()
+
+    def start(self) -> FetchToken:
+        for url, filename in self.entries:
+            self.executor.submit(self._export_one, url, filename, priority=PRIORITY_BACKGROUND, token=self._token)
+        return self._token
+
+    def cancel(self) -> None:
+        self._token.cancel()
+
+    def _export_one(self, url: str, filename: str, token: FetchToken) -> None:
+        path = os.path.join(self.directory, filename)
+        ok = True
+        try:
+            cached = self.cache.get_path(url)
+            try:
+                if cached is None:
+                    raise FileNotFoundError(url)
+                atomic_copy(cached, path)
+            except FileNotFoundError:
+                # Evicted meanwhile, or never cached
+                content = download(url, self.http, token)
+                self.cache.put(url, content)
+                atomic_write(path, content, public=True)
+        except Exception as e:
+            if token.cancelled:
+                return
+            print(f"Error exporting {url}: {e}")
+            ok = False
+        with self._lock:
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+            done, failed = self.done, self.failed
+        if self.on_progress:
+            self.on_progress(done, failed, len(self.entries))
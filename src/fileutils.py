@@ -0,0 +1,110 @@
+import os
+import tempfile
+from typing import Iterable
+
+# Read once, os.umask() can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def get_user_cache_dir() -> str:
+    # Same location as GLib.get_user_cache_dir(), without requiring gi
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "catgirldownloader")
+
+
+def _public_mode(path: str) -> int:
+    """Returns the permissions a file the user sees should get: those of the file it replaces, or the umask's."""
+    try:
+        return os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def atomic_write(path: str, content: bytes, public: bool = False) -> None:
+    """
+    Writes content to path so that readers never see a partial file.
+    The file is private to the user unless public is set, which is
+    for files the user asked for, like saved images.
+    """
+    atomic_write_chunks(path, [content], public)
+
+
+def atomic_write_chunks(path: str, chunks: Iterable[bytes], public: bool = False) -> None:
+    """Like atomic_write(), for content produced a piece at a time."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        if public:
+            os.fchmod(fd, _public_mode(path))
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _copy_fd(src: int, dst: int, size: int) -> None:
+    """Copies size bytes between file descriptors inside the kernel when possible."""
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                n = os.copy_file_range(src, dst, size - copied)
+                if n == 0:
+                    break
+                copied += n
+            if copied == size:
+                return
+        except OSError:
+            # Not supported between these filesystems, try the next method
+            pass
+    try:
+        while copied < size:
+            n = os.sendfile(dst, src, copied, size - copied)
+            if n == 0:
+                break
+            copied += n
+        if copied == size:
+            return
+    except (OSError, AttributeError):
+        pass
+    os.lseek(src, copied, os.SEEK_SET)
+    os.lseek(dst, copied, os.SEEK_SET)
+    while True:
+        chunk = os.read(src, 1024 * 1024)
+        if not chunk:
+            return
+        os.write(dst, chunk)
+
+
+def atomic_copy(source: str, path: str) -> None:
+    """Copies the file source to path so that readers never see a partial file."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        # mkstemp creates the file private, saved images should look like any other file
+        os.fchmod(fd, _public_mode(path))
+        with open(source, "rb") as src:
+            _copy_fd(src.fileno(), fd, os.fstat(src.fileno()).st_size)
+        os.fsync(fd)
+        os.close(fd)
+        fd = -1
+        os.replace(tmp_path, path)
+    except Exception:
+        if fd >= 0:
+            os.close(fd)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+import time
+import weakref
+from array import array
+from typing import Iterator, Optional
+
+from gi.repository import GLib, GObject, Gio
+
+from .fileutils import atomic_write_chunks, get_user_cache_dir
+
+# Entries kept on disk, older ones are dropped when the history is loaded
+MAX_ENTRIES = 50000
+# Bytes of history.jsonl read at a time while loading it
+READ_CHUNK = 1024 * 1024
+
+
+class HistoryItem(GObject.Object):
+    """One shown image, loaded from the history file when GTK asks for it."""
+    __gtype_name__ = 'HistoryItem'
+
+    def __init__(self, index: int, record: dict) -> None:
+        super().__init__()
+        self.index = index
+        self.url = record.get("url")
+        self.source_id = record.get("source")
+        self.info = record.get("info")
+        self.time = record.get("time")
+
+
+class HistoryModel(GObject.Object, Gio.ListModel):
+    """
+    List of previously shown images, newest first.
+
+    Only the offsets of the lines of history.jsonl are kept in memory;
+    items are parsed from the file when a visible row needs them, so tens
+    of thousands of entries cost a few hundred kilobytes. The file is
+    scanned on a thread, the model is empty until "loaded" is emitted.
+    """
+    __gtype_name__ = 'HistoryModel'
+    __gsignals__ = {
+        "loaded": (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        super().__init__()
+        self.path = path if path else os.path.join(get_user_cache_dir(), "history.jsonl")
+        self._offsets = array("Q")
+        # Items GTK still holds, so repeated lookups return the same object
+        self._items: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        # URLs of the entries dropped when loading, their thumbnails can go
+        self.dropped_urls: list = []
+        self.loaded = False
+        self._file = None
+        # Records appended before loading finished, written once it has
+        self._pending: list = []
+        self._scanned = (array("Q"), [])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._thread = threading.Thread(target=self._load_thread, daemon=True)
+        self._thread.start()
+
+    def _load_thread(self) -> None:
+        try:
+            self._scanned = self._scan()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error reading history: {e}")
+        GLib.idle_add(self._on_loaded)
+
+    def _scan(self) -> tuple:
+        """Returns the line offsets of the history file and the URLs of the entries dropped from it."""
+        offsets = array("Q")
+        # Start of the line being read
+        start = 0
+        position = 0
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+                end = chunk.find(b"\n")
+                while end >= 0:
+                    offsets.append(start)
+                    start = position + end + 1
+                    end = chunk.find(b"\n", end + 1)
+                position += len(chunk)
+        if start < position:
+            # A crash left half a line behind, the next entry must not be glued to it
+            os.truncate(self.path, start)
+
+        if len(offsets) <= MAX_ENTRIES:
+            return offsets, []
+        keep = offsets[-MAX_ENTRIES]
+        try:
+            dropped = self._trim(keep, start)
+        except Exception as e:
+            print(f"Error writing history: {e}")
+            return offsets, []
+        return array("Q", (offset - keep for offset in offsets[-MAX_ENTRIES:])), dropped
+
+    def _trim(self, keep: int, end: int) -> list:
+        """Drops the entries before offset keep from the file, returns their URLs."""
+        with open(self.path, "rb") as f:
+            dropped = []
+            while f.tell() < keep:
+                dropped.append(self._parse(f.readline()).get("url"))
+
+            def _chunks() -> Iterator[bytes]:
+                remaining = end - keep
+                while remaining > 0:
+                    chunk = f.read(min(READ_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+            atomic_write_chunks(self.path, _chunks())
+        return dropped
+
+    def _on_loaded(self) -> bool:
+        if self.loaded:
+            return False
+        self._offsets, self.dropped_urls = self._scanned
+        try:
+            self._file = open(self.path, "a+b")
+        except Exception as e:
+            print(f"Error opening history: {e}")
+        self.loaded = True
+        if self._offsets:
+            self.items_changed(0, 0, len(self._offsets))
+        pending, self._pending = self._pending, []
+        for record in pending:
+            self._write(record)
+        self.emit("loaded")
+        return False
+
+    def do_get_item_type(self):
+        return HistoryItem.__gtype__
+
+    def do_get_n_items(self) -> int:
+        return len(self._offsets)
+
+    def do_get_item(self, position: int) -> Optional[HistoryItem]:
+        if position >= len(self._offsets):
+            return None
+        index = len(self._offsets) - 1 - position
+        item = self._items.get(index)
+        if item is None:
+            item = HistoryItem(index, self._read(index))
+            self._items[index] = item
+        return item
+
+    def _read(self, index: int) -> dict:
+        try:
+            self._file.seek(self._offsets[index])
+            return self._parse(self._file.readline())
+        except Exception as e:
+            print(f"Error reading history entry: {e}")
+            return {}
+
+    @staticmethod
+    def _parse(line: bytes) -> dict:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return {}
+        return record if isinstance(record, dict) else {}
+
+    def append(self, url: str, source_id: str, info: Optional[dict]) -> None:
+        """Adds an entry, info should only hold what the gallery needs to show it again."""
+        record = {"url": url, "source": source_id, "time": int(time.time()), "info": info}
+        if self.loaded:
+            self._write(record)
+        else:
+            self._pending.append(record)
+
+    def _write(self, record: dict) -> None:
+        try:
+            line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+        except Exception as e:
+            print(f"Error writing history: {e}")
+            return
+        self._offsets.append(offset)
+        self.items_changed(0, 0, 1)
+
+    def close(self) -> None:
+        # Entries shown before loading finished must not be lost
+        self._thread.join()
+        self._on_loaded()
+        if self._file:
+            self._file.close()
@@ -0,0 +1,139 @@
+import threading
+import time
+from typing import Any, Iterable, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .rate_limit import RateLimiter, RateLimitedError, get_default_limiter
+from .metrics import get_default_metrics
+
+Timeout = Union[float, Tuple[float, float]]
+
+# Longest a request waits for its host's rate limit before failing instead
+MAX_RATE_LIMIT_WAIT = 10
+# Retries of a request answered with 429 or a 5xx gateway error
+MAX_RETRIES = 2
+
+
+class HttpClient:
+    """
+    Shared HTTP client used by every downloader source and image fetch.
+
+    Connections are kept alive in per-host pools, so consecutive refreshes
+    against the same API or CDN skip the TCP and TLS handshakes. Every
+    request goes through the rate limiter of its host.
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 10,
+                 connect_timeout: float = 5, read_timeout: float = 20,
+                 limiter: Optional[RateLimiter] = None) -> None:
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.limiter = limiter if limiter else get_default_limiter()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Exponentially weighted average of body download speed, in bytes/s
+        self._throughput: Optional[float] = None
+        self._throughput_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> "HttpClient":
+        def _get(key: str, default: float) -> float:
+            value = settings.get_preference(key) if settings else None
+            try:
+                return float(value) if value is not None else default
+            except Exception:
+                return default
+
+        pool_size = int(_get("http_pool_size", 10))
+        return cls(pool_connections=pool_size, pool_maxsize=pool_size,
+                   connect_timeout=_get("http_connect_timeout", 5),
+                   read_timeout=_get("http_read_timeout", 20))
+
+    def _timeout(self, timeout: Optional[Timeout]) -> Timeout:
+        if timeout is None:
+            return (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, tuple):
+            return timeout
+        # A single number used to be the total timeout for requests.get(),
+        # keep it as the read timeout but never wait longer to connect
+        return (min(self.connect_timeout, timeout), timeout)
+
+    def get(self, url: str, params: Optional[dict] = None, timeout: Optional[Timeout] = None,
+            stream: bool = False, **kwargs: Any) -> requests.Response:
+        """
+        Sends a GET request once the host's rate limit allows it. Requests
+        answered with 429 or 5xx are retried after the backoff, the last
+        such response is returned if retrying would take too long.
+        """
+        host = urlsplit(url).hostname or ""
+        response = None
+        for _attempt in range(MAX_RETRIES + 1):
+            try:
+                delay = self.limiter.reserve(host, MAX_RATE_LIMIT_WAIT)
+            except RateLimitedError:
+                if response is None:
+                    raise
+                return response
+            if response is not None:
+                response.close()
+            if delay:
+                time.sleep(delay)
+            response = self.session.get(url, params=params, timeout=self._timeout(timeout), stream=stream, **kwargs)
+            if not self.limiter.update(host, response.status_code, response.headers):
+                return response
+            get_default_metrics().increment("http_retries", host=host, status=str(response.status_code))
+        return response
+
+    def record_throughput(self, size: int, seconds: float) -> None:
+        """Feeds the measured duration of a body download into the speed estimate."""
+        # Tiny bodies are dominated by latency and say nothing about bandwidth
+        if size < 64 * 1024 or seconds <= 0:
+            return
+        sample = size / seconds
+        with self._throughput_lock:
+            if self._throughput is None:
+                self._throughput = sample
+            else:
+                self._throughput = 0.7 * self._throughput + 0.3 * sample
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Estimated download speed in bytes/s, None until something was downloaded."""
+        return self._throughput
+
+    def warm_up(self, hosts: Iterable[str]) -> None:
+        """
+        Opens connections to hosts in the background so that the first real
+        request does not pay for the handshake.
+        """
+        def _warm_up(url: str) -> None:
+            try:
+                self.session.head(url, timeout=(self.connect_timeout, self.connect_timeout), allow_redirects=False).close()
+            except Exception:
+                pass
+
+        for host in hosts:
+            url = host if urlsplit(host).scheme else f"https://{host}/"
+            thread = threading.Thread(target=_warm_up, args=[url], daemon=True)
+            thread.start()
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_default_client: Optional[HttpClient] = None
+_default_lock = threading.Lock()
+
+
+def get_default_client() -> HttpClient:
+    """Client used by sources that were not given one explicitly."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
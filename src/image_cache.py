@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from .fileutils import atomic_write, get_user_cache_dir
+
+# Seconds the index waits for further changes before it is written
+SAVE_DELAY = 2.0
+
+
+class ImageCache:
+    """
+    On-disk, content-addressed cache of downloaded images.
+
+    Images are stored under the SHA-256 of their content, an index maps
+    URLs to hashes. The least recently used images are evicted once the
+    total size goes over max_bytes.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory if directory else os.path.join(get_user_cache_dir(), "images")
+        self.objects_directory = os.path.join(self.directory, "objects")
+        self.index_file = os.path.join(self.directory, "index.json")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # hash -> size, least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._urls: dict = {}
+        # hash -> set of urls, so forgetting an entry doesn't scan every url
+        self._hashes: dict = {}
+        self._total_bytes = 0
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        # Serializes index writes, which happen outside self._lock
+        self._save_lock = threading.Lock()
+        os.makedirs(self.objects_directory, exist_ok=True)
+        self._load_index()
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> "ImageCache":
+        value = settings.get_preference("cache_size_mb") if settings else None
+        try:
+            megabytes = int(value) if value is not None else 256
+        except Exception:
+            megabytes = 256
+        return cls(max_bytes=max(0, megabytes) * 1024 * 1024)
+
+    def _object_path(self, content_hash: str) -> str:
+        return os.path.join(self.objects_directory, content_hash[:2], content_hash)
+
+    def _load_index(self) -> None:
+        try:
+            with open(self.index_file, "r") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = {}
+        except Exception as e:
+            print(f"Error reading image cache index: {e}")
+            index = {}
+
+        # Only trust entries whose file survived, a crash can lose either side
+        for content_hash in index.get("entries", []):
+            try:
+                size = os.path.getsize(self._object_path(content_hash))
+            except OSError:
+                continue
+            self._entries[content_hash] = size
+            self._total_bytes += size
+        for url, content_hash in index.get("urls", {}).items():
+            if content_hash in self._entries:
+                self._set_url(url, content_hash)
+
+    def _set_url(self, url: str, content_hash: str) -> None:
+        previous = self._urls.get(url)
+        if previous is not None and previous != content_hash:
+            self._hashes.get(previous, set()).discard(url)
+        self._urls[url] = content_hash
+        self._hashes.setdefault(content_hash, set()).add(url)
+
+    def _mark_dirty(self) -> None:
+        """Schedules a write of the index, changes within SAVE_DELAY share it. Needs self._lock."""
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(SAVE_DELAY, self._save_index)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_index(self) -> None:
+        with self._save_lock:
+            with self._lock:
+                self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = json.dumps({"entries": list(self._entries), "urls": self._urls}).encode("utf-8")
+            try:
+                atomic_write(self.index_file, data)
+            except Exception as e:
+                print(f"Error writing image cache index: {e}")
+
+    def get_path(self, url: str) -> Optional[str]:
+        """Returns the path of the cached file for url, or None."""
+        with self._lock:
+            content_hash = self._urls.get(url)
+            if content_hash is None or content_hash not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(content_hash)
+            self.hits += 1
+            return self._object_path(content_hash)
+
+    def get(self, url: str) -> Optional[bytes]:
+        path = self.get_path(url)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                self._forget(self._urls.get(url))
+            return None
+
+    def put(self, url: str, content: bytes) -> Optional[str]:
+        """Stores content for url and returns its hash."""
+        if self.max_bytes <= 0 or len(content) > self.max_bytes:
+            return None
+        content_hash = hashlib.sha256(content).hexdigest()
+        path = self._object_path(content_hash)
+        with self._lock:
+            known = content_hash in self._entries
+        if not known:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                atomic_write(path, content)
+            except Exception as e:
+                print(f"Error writing image cache entry: {e}")
+                return None
+        with self._lock:
+            if content_hash not in self._entries:
+                self._entries[content_hash] = len(content)
+                self._total_bytes += len(content)
+            self._entries.move_to_end(content_hash)
+            self._set_url(url, content_hash)
+            self._evict()
+            self._mark_dirty()
+        return content_hash
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            content_hash = next(iter(self._entries))
+            self._forget(content_hash)
+            self.evictions += 1
+
+    def _forget(self, content_hash: Optional[str]) -> None:
+        if content_hash is None or content_hash not in self._entries:
+            return
+        self._total_bytes -= self._entries.pop(content_hash)
+        for url in self._hashes.pop(content_hash, ()):
+            self._urls.pop(url, None)
+        self._mark_dirty()
+        try:
+            os.unlink(self._object_path(content_hash))
+        except OSError:
+            pass
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max(0, max_bytes)
+            self._evict()
+            self._mark_dirty()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+            # Persist the access order collected by get() too
+            self._dirty = True
+        self._save_index()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_default_cache: Optional[ImageCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> ImageCache:
+    """Cache used by sources that were not given one explicitly."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ImageCache()
+        return _default_cache
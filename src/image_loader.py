@@ -0,0 +1,207 @@
+import time
+from gi.repository import Gdk, GdkPixbuf, GLib
+
+from .download import download
+from .executor import CancelledError, PRIORITY_USER, get_default_executor
+from .metrics import get_default_metrics
+from .tracing import get_tracer, trace_span
+
+# Minimum seconds between two partial frames in progressive mode
+PROGRESS_INTERVAL = 0.1
+
+
+def limit_decode_size(pixbuf_loader, max_size):
+    """
+    Makes pixbuf_loader decode straight to a size that fits within max_size,
+    keeping the aspect ratio. Images that already fit are left alone.
+    """
+    def _on_size_prepared(loader, width, height):
+        max_width, max_height = max_size
+        if width <= max_width and height <= max_height:
+            return
+        scale = min(max_width / width, max_height / height)
+        loader.set_size(max(1, round(width * scale)), max(1, round(height * scale)))
+
+    if max_size:
+        pixbuf_loader.connect("size-prepared", _on_size_prepared)
+
+
+def decode_image(content, max_size=None):
+    """Decodes already downloaded image bytes, returning the closed loader."""
+    with trace_span("decode", bytes=len(content)):
+        pixbuf_loader = GdkPixbuf.PixbufLoader()
+        limit_decode_size(pixbuf_loader, max_size)
+        pixbuf_loader.write(bytes(content))
+        pixbuf_loader.close()
+    return pixbuf_loader
+
+
+def texture_from_pixbuf(pixbuf):
+    """
+    Wraps the pixels of pixbuf in a Gdk.MemoryTexture without copying them,
+    the texture keeping pixbuf alive. Textures are immutable, so pixbuf
+    must not change afterwards. This can run on a worker thread and the
+    main thread only has to hand the result to a Gtk.Picture.
+    """
+    memory_format = Gdk.MemoryFormat.R8G8B8A8 if pixbuf.get_has_alpha() else Gdk.MemoryFormat.R8G8B8
+    return Gdk.MemoryTexture.new(pixbuf.get_width(), pixbuf.get_height(), memory_format,
+                                 pixbuf.read_pixel_bytes(), pixbuf.get_rowstride())
+
+
+class DecodedImage:
+    """A decoded image ready to be shown, the pixbuf itself is not kept."""
+
+    def __init__(self, texture, width, height, extension=None, size=0):
+        self.texture = texture
+        self.width = width
+        self.height = height
+        # File extension of the decoded format, like "png"
+        self.extension = extension
+        # Bytes used by the pixels
+        self.size = size
+
+    @classmethod
+    def from_loader(cls, pixbuf_loader):
+        with trace_span("texture"):
+            pixbuf = pixbuf_loader.get_pixbuf()
+            image_format = pixbuf_loader.get_format()
+            extension = image_format.extensions[0] if image_format and image_format.extensions else None
+            return cls(texture_from_pixbuf(pixbuf), pixbuf.get_width(), pixbuf.get_height(), extension,
+                       pixbuf.get_rowstride() * pixbuf.get_height())
+
+
+def decode_texture(content, max_size=None):
+    """Decodes image bytes into a DecodedImage, meant to run on a worker thread."""
+    return DecodedImage.from_loader(decode_image(content, max_size))
+
+
+class _ProgressiveUpdates:
+    """Collects partial frames from a PixbufLoader and reports them at most every PROGRESS_INTERVAL."""
+
+    def __init__(self, pixbuf_loader, on_update):
+        self._on_update = on_update
+        self._pixbuf = None
+        self._dirty = False
+        self._last_update = 0.0
+        pixbuf_loader.connect("area-prepared", self._on_area_prepared)
+        pixbuf_loader.connect("area-updated", self._on_area_updated)
+
+    def _on_area_prepared(self, loader):
+        self._pixbuf = loader.get_pixbuf()
+
+    def _on_area_updated(self, loader, x, y, width, height):
+        self._dirty = True
+
+    def on_progress(self, received, total):
+        now = time.monotonic()
+        if now - self._last_update < PROGRESS_INTERVAL and received != total:
+            return
+        self._last_update = now
+        frame = None
+        if self._dirty and self._pixbuf is not None:
+            # The loader keeps writing into its pixbuf, the texture wraps a snapshot
+            frame = texture_from_pixbuf(self._pixbuf.copy())
+            self._dirty = False
+        self._on_update(frame, received, total)
+
+
+def load_image(url, http=None, cache=None, token=None, max_size=None, on_update=None, source=None):
+    """
+    Download and decode an image synchronously.
+
+    Args:
+        url (str): The URL of the image to load
+        http (HttpClient, optional): Client to download with, defaults to the shared one
+        cache (ImageCache, optional): Cache checked before downloading and filled afterwards
+        token (FetchToken, optional): Cancelling it aborts the download with CancelledError
+        max_size (tuple, optional): (width, height) in device pixels to decode down to,
+                                    the returned content is always the original file
+        on_update (callable, optional): Called on the loading thread with
+                                        (partial_texture_or_None, received_bytes, total_bytes_or_None)
+                                        at most every PROGRESS_INTERVAL while downloading
+        source (str, optional): Id of the source the image comes from, used to label metrics
+
+    Returns:
+        tuple: (pixbuf_loader, content) once the loader has been closed, content
+        being the download buffer itself (bytes when served from the cache)
+    """
+    metrics = get_default_metrics()
+    labels = {"source": source} if source else {}
+    cached = cache.get(url) if cache else None
+    if cached is not None:
+        with metrics.timer("decode", **labels):
+            return decode_image(cached, max_size), cached
+
+    pixbuf_loader = GdkPixbuf.PixbufLoader()
+    limit_decode_size(pixbuf_loader, max_size)
+    progress = _ProgressiveUpdates(pixbuf_loader, on_update) if on_update else None
+
+    def _write(view):
+        # PyGObject needs bytes at the GI boundary, so only this chunk is copied
+        with trace_span("decode_chunk", bytes=len(view)):
+            pixbuf_loader.write(view.tobytes())
+
+    try:
+        # Decoding happens while the body streams in, it is part of this stage
+        with metrics.timer("download", **labels):
+            content = download(url, http, token, _write, progress.on_progress if progress else None)
+            pixbuf_loader.close()
+    except Exception:
+        try:
+            pixbuf_loader.close()
+        except Exception:
+            pass
+        raise
+    metrics.observe("image", len(content), unit="bytes", **labels)
+    if cache:
+        cache.put(url, content)
+    return pixbuf_loader, content
+
+
+def load_image_with_callback(url, callback, error_callback=None, http=None, cache=None, executor=None, token=None,
+                             max_size=None, source=None):
+    """
+    Load an image from URL and call the callback with the pixbuf loader when complete.
+
+    Args:
+        url (str): The URL of the image to load
+        callback (callable): Function to call when image is loaded successfully.
+                           Should accept (pixbuf_loader, content_bytes) as argument
+        error_callback (callable, optional): Function to call on error.
+                                           Should accept (exception) as argument
+        http (HttpClient, optional): Client to download with, defaults to the shared one
+        cache (ImageCache, optional): Cache checked before downloading and filled afterwards
+        executor (FetchExecutor, optional): Pool to run the download on, defaults to the shared one
+        token (FetchToken, optional): Cancelling it drops the download without calling back
+        max_size (tuple, optional): (width, height) in device pixels to decode down to
+        source (str, optional): Id of the source the image comes from, used to label metrics
+
+    Returns:
+        FetchToken: the token the download runs under
+    """
+    labels = {"source": source} if source else {}
+
+    def _on_main_thread(queued, pixbuf_loader, data):
+        # How long the result waited for the main loop
+        get_default_metrics().observe("dispatch", time.monotonic() - queued, **labels)
+        tracer = get_tracer()
+        if tracer:
+            tracer.complete("dispatch", queued, **labels)
+        with trace_span("callback", **labels):
+            return callback(pixbuf_loader, data)
+
+    def _load_image(token):
+        try:
+            with trace_span("load_image", url=url, **labels):
+                pixbuf_loader, data = load_image(url, http, cache, token, max_size, source=source)
+            # Schedule callback on main thread
+            GLib.idle_add(_on_main_thread, time.monotonic(), pixbuf_loader, data)
+        except CancelledError:
+            pass
+        except Exception as e:
+            print(f"Exception loading image: {e}")
+            if error_callback:
+                GLib.idle_add(error_callback, e)
+
+    # Run the loading on a worker thread to avoid blocking the UI
+    return (executor or get_default_executor()).submit(_load_image, priority=PRIORITY_USER, token=token)
@@ -26,6 +26,16 @@ gi.require_version('Adw', '1')
 from gi.repository import Gtk, Gio, Adw, Gdk, GLib
 from .window import CatgirldownloaderWindow
 from .preferenceswindow import PreferencesWindow
+from .metricswindow import MetricsWindow
+from .preferences import UserPreferences
+from .http_client import HttpClient
+from .image_cache import ImageCache
+from .executor import FetchExecutor
+from .async_engine import AsyncEngine
+from .seen_index import SeenIndex
+from .history import HistoryModel
+from .metrics import get_default_metrics
+from .profiling import install_stall_detector
 
 class CatgirldownloaderApplication(Adw.Application):
     """The main application singleton class."""
@@ -33,15 +43,36 @@ class CatgirldownloaderApplication(Adw.Application):
     def __init__(self):
         super().__init__(application_id='moe.nyarchlinux.catgirldownloader',
                          flags=Gio.ApplicationFlags.FLAGS_NONE)
+        self.metrics = get_default_metrics()
         self.create_action('quit', lambda action, _: self.quit(), ['<primary>q'])
         self.create_action('about', self.on_about_action)
         self.create_action('show-art-about', self.on_art_about_action)
         self.create_action('preferences', self.on_preferences_action)
+        self.create_action('export-recent', lambda action, _: self.window.export_dialog())
+        self.create_action('metrics', self.on_metrics_action)
         self.create_action('reload', self.on_reload, ['<primary>r'])
 
     def on_reload(self, widget, _):
         self.window.async_reloadimage()
 
+    def do_startup(self):
+        """
+        Called in the primary instance only, a second launch just forwards
+        activation to it, so the shared services are created here.
+        """
+        Adw.Application.do_startup(self)
+        settings = UserPreferences.get_default()
+        self.http = HttpClient.from_settings(settings)
+        self.cache = ImageCache.from_settings(settings)
+        self.executor = FetchExecutor.from_settings(settings)
+        self.engine = AsyncEngine.from_settings(settings, self.http)
+        self.seen = SeenIndex.from_settings(settings)
+        self.history = HistoryModel()
+        self.metrics.add_collector("image_cache", lambda: self.cache.stats)
+        self.metrics.add_collector("seen_index", lambda: self.seen.stats)
+        self.metrics.add_collector("http", lambda: {"throughput_bytes_per_second": self.http.throughput or 0})
+        install_stall_detector(GLib.timeout_add)
+
     def do_activate(self):
         """Called when the application is activated.
 
@@ -50,11 +81,23 @@ class CatgirldownloaderApplication(Adw.Application):
         """
         win = self.props.active_window
         if not win:
-            win = CatgirldownloaderWindow(application=self)
+            win = CatgirldownloaderWindow(application=self, http=self.http, cache=self.cache,
+                                          executor=self.executor, engine=self.engine, seen=self.seen,
+                                          history=self.history)
         win.set_title("Catgirl Downloader")
         self.window = win
         win.present()
 
+    def do_shutdown(self):
+        UserPreferences.get_default().flush()
+        self.executor.shutdown()
+        self.engine.shutdown()
+        self.http.close()
+        self.cache.close()
+        self.seen.close()
+        self.history.close()
+        Adw.Application.do_shutdown(self)
+
     def on_about_action(self, widget, _):
         """Callback for the app.about action."""
         about = Adw.AboutWindow(transient_for=self.props.active_window,
@@ -69,10 +112,11 @@ class CatgirldownloaderApplication(Adw.Application):
     def on_art_about_action(self, widget, _):
         """Callback for the app.about action."""
         if hasattr(self.window, "info") and self.window.info:
-            item = self.window.source_selector.get_selected_item()
-            if item and hasattr(item, "api"):
-                artist = item.api.get_artist(self.window.info)
-                link = item.api.get_link(self.window.info)
+            # May differ from the selected source when another one answered first
+            api = self.window.get_image_downloader()
+            if api:
+                artist = api.get_artist(self.window.info)
+                link = api.get_link(self.window.info)
 
                 artists = [artist] if artist else []
                 website = link if link else ""
@@ -81,6 +125,13 @@ class CatgirldownloaderApplication(Adw.Application):
                                         artists=artists,
                                         website=website)
                 about.present()
+                # Likely to be saved next, start downloading the full original
+                self.window.fetch_original()
+
+    def on_metrics_action(self, widget, _):
+        """Callback for the app.metrics action."""
+        window = MetricsWindow(self.metrics, transient_for=self.window)
+        window.present()
 
     def on_preferences_action(self, widget, _):
         """Callback for the app.preferences action."""
@@ -0,0 +1,219 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from .executor import CancelledError
+
+# Upper bounds of the duration buckets, in seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Upper bounds of the size buckets, in bytes
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+BUCKETS = {"seconds": DURATION_BUCKETS, "bytes": SIZE_BUCKETS}
+
+
+class Histogram:
+    """Counts observations into fixed buckets, memory does not grow with the number of samples."""
+
+    def __init__(self, unit: str) -> None:
+        self.unit = unit
+        self.buckets = BUCKETS[unit]
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimates the q quantile by interpolating inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else (self.min or 0.0)
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                low, high = max(low, self.min), min(high, self.max)
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "unit": self.unit,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+def _format(value: Optional[float], unit: str) -> str:
+    if value is None:
+        return "-"
+    return f"{value / 1024:.0f} KiB" if unit == "bytes" else f"{value * 1000:.1f} ms"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _prometheus_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _name, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _value), value in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """
+    In-process metrics of the fetch pipeline: histograms of stage durations
+    and sizes and counters of retries and errors, each keyed by labels such
+    as the source. Collectors add gauges read at snapshot time, for example
+    the statistics of the image cache.
+    """
+
+    def __init__(self, prefix: str = "catgirldownloader") -> None:
+        self.prefix = prefix
+        self.started = time.time()
+        self._histograms: dict = {}
+        self._counters: dict = {}
+        self._collectors: dict = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, unit: str = "seconds", **labels: str) -> None:
+        """Adds value, in seconds or bytes, to the histogram name."""
+        key = _label_key(labels)
+        with self._lock:
+            histogram = self._histograms.setdefault(name, {}).get(key)
+            if histogram is None:
+                histogram = Histogram(unit)
+                self._histograms[name][key] = histogram
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Observes how long the block took, and counts the exception if it raised one other than a cancellation."""
+        start = time.perf_counter()
+        try:
+            yield
+        except CancelledError:
+            raise
+        except Exception as e:
+            self.increment("errors", stage=name, error=type(e).__name__, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, name: str, collect: Callable[[], dict]) -> None:
+        """Registers collect(), returning a dict of numbers, to be read on every snapshot."""
+        with self._lock:
+            self._collectors[name] = collect
+
+    def _collect(self) -> dict:
+        with self._lock:
+            collectors = dict(self._collectors)
+        gauges = {}
+        for name, collect in collectors.items():
+            try:
+                gauges[name] = {key: value for key, value in collect().items() if isinstance(value, (int, float))}
+            except Exception as e:
+                print(f"Error collecting {name} metrics: {e}")
+        return gauges
+
+    def snapshot(self) -> dict:
+        gauges = self._collect()
+        with self._lock:
+            return {
+                "uptime": time.time() - self.started,
+                "histograms": {name: [dict(labels=dict(key), **histogram.snapshot())
+                                      for key, histogram in series.items()]
+                               for name, series in self._histograms.items()},
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                             for name, series in self._counters.items()},
+                "gauges": gauges,
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        gauges = self._collect()
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                metric = f"{self.prefix}_{name}_{next(iter(series.values())).unit}"
+                lines.append(f"# TYPE {metric} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_prometheus_labels(key, (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{metric}_sum{_prometheus_labels(key)} {histogram.sum}")
+                    lines.append(f"{metric}_count{_prometheus_labels(key)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_prometheus_labels(key)} {value}")
+        for name, values in sorted(gauges.items()):
+            for key, value in sorted(values.items()):
+                metric = f"{self.prefix}_{name}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Returns a plain text table of the histograms and counters, for the debug panel."""
+        snapshot = self.snapshot()
+        lines = [f"{'stage':<22}{'labels':<28}{'count':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"]
+        for name, series in sorted(snapshot["histograms"].items()):
+            for entry in series:
+                labels = ",".join(f"{key}={value}" for key, value in sorted(entry["labels"].items()))
+                values = [_format(entry[column], entry["unit"]) for column in ("p50", "p90", "p99", "max")]
+                lines.append(f"{name:<22}{labels:<28}{entry['count']:>7}" + "".join(f"{value:>10}" for value in values))
+        lines.append("")
+        for name, series in sorted(snapshot["counters"].items()):
+            for entry in series:
+                labels = ",".join(f"{key}={value}" for key, value in sorted(entry["labels"].items()))
+                lines.append(f"{name:<22}{labels:<50}{entry['value']:>10g}")
+        for name, values in sorted(snapshot["gauges"].items()):
+            lines.append("")
+            for key, value in sorted(values.items()):
+                lines.append(f"{name + '.' + key:<72}{value:>10g}")
+        return "\n".join(lines)
+
+
+_default_metrics: Optional[MetricsRegistry] = None
+_default_lock = threading.Lock()
+
+
+def get_default_metrics() -> MetricsRegistry:
+    """Registry every part of the pipeline records into."""
+    global _default_metrics
+    with _default_lock:
+        if _default_metrics is None:
+            _default_metrics = MetricsRegistry()
+        return _default_metrics
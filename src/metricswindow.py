@@ -0,0 +1,69 @@
+from gi.repository import Gtk, Adw, GLib, Gio
+
+from .metrics import MetricsRegistry
+
+# Seconds between two refreshes of the table
+REFRESH_INTERVAL = 1
+
+
+class MetricsWindow(Adw.Window):
+    """Debug panel showing the fetch pipeline metrics, with JSON and Prometheus export."""
+    __gtype_name__ = 'MetricsWindow'
+
+    def __init__(self, metrics: MetricsRegistry, **kwargs):
+        super().__init__(title="Metrics", default_width=760, default_height=480, **kwargs)
+        self.metrics = metrics
+
+        header = Adw.HeaderBar()
+        json_button = Gtk.Button(label="Export JSON")
+        json_button.connect("clicked", lambda *_: self._export("metrics.json", self.metrics.to_json))
+        header.pack_end(json_button)
+        prometheus_button = Gtk.Button(label="Export Prometheus")
+        prometheus_button.connect("clicked", lambda *_: self._export("metrics.prom", self.metrics.to_prometheus))
+        header.pack_end(prometheus_button)
+
+        self.text_view = Gtk.TextView(editable=False, cursor_visible=False, monospace=True,
+                                      top_margin=12, bottom_margin=12, left_margin=12, right_margin=12)
+        scrolled = Gtk.ScrolledWindow(vexpand=True)
+        scrolled.set_child(self.text_view)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        box.append(header)
+        box.append(scrolled)
+        self.set_content(box)
+
+        self._refresh()
+        self._timeout_id = GLib.timeout_add_seconds(REFRESH_INTERVAL, self._refresh)
+        self.connect("close-request", self._on_close)
+
+    def _refresh(self):
+        self.text_view.get_buffer().set_text(self.metrics.summary())
+        return True
+
+    def _on_close(self, *_):
+        if self._timeout_id is not None:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+        return False
+
+    def _export(self, name, render):
+        dialog = Gtk.FileChooserDialog(title="Export metrics", parent=self, action=Gtk.FileChooserAction.SAVE)
+        dialog.set_current_name(name)
+        dialog.add_button('Cancel', Gtk.ResponseType.CANCEL)
+        dialog.add_button('Save', Gtk.ResponseType.OK)
+
+        def on_response(dialog, response_id):
+            if response_id == Gtk.ResponseType.OK:
+                dialog.get_file().replace_contents_bytes_async(
+                    GLib.Bytes.new(render().encode("utf-8")), None, False, Gio.FileCreateFlags.NONE, None,
+                    self._on_written)
+            dialog.destroy()
+
+        dialog.connect('response', on_response)
+        dialog.show()
+
+    def _on_written(self, file, result):
+        try:
+            file.replace_contents_finish(result)
+        except GLib.Error as e:
+            print(f"Error exporting metrics: {e.message}")
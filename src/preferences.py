@@ -1,68 +1,141 @@
-from gi.repository import GLib
+from gi.repository import GLib, Gio, GObject
 import os
 import json
 
-class UserPreferences:
+from .fileutils import atomic_write
+
+# Milliseconds to wait for more changes before writing config.json
+SAVE_DELAY = 500
+
+
+class UserPreferences(GObject.Object):
+    """
+    Process-wide preferences store.
+
+    Reads are served from memory. Writes are coalesced and saved atomically
+    after SAVE_DELAY, external edits of config.json are picked up through a
+    file monitor. The "changed" signal is emitted with the key, detailed by
+    it, whenever a value actually changes.
+    """
+    __gtype_name__ = 'UserPreferences'
+
+    __gsignals__ = {
+        "changed": (GObject.SignalFlags.RUN_FIRST | GObject.SignalFlags.DETAILED, None, (str,)),
+    }
+
+    _default = None
+
+    @classmethod
+    def get_default(cls):
+        """Returns the store shared by the whole application."""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
     def __init__(self):
+        super().__init__()
         self._defaults = {
             "nsfw_mode": "Block NSFW",
             "auto_reload_enabled": False,
             "auto_reload_interval": 5,
             "danbooru_tags": "",
+            "progressive_loading": True,
+            "prefetch_depth": 2,
+            "prefetch_memory_mb": 64,
+            "http_pool_size": 10,
+            "http_connect_timeout": 5,
+            "http_read_timeout": 20,
+            "cache_size_mb": 256,
+            "fetch_workers": 4,
+            "hedge_requests": False,
+            "seen_index_memory_kb": 256,
+            "seen_index_fp_rate": 0.01,
         }
         self.preferences = dict(self._defaults)
+        self._save_timeout_id = None
         self.directory = os.path.join(GLib.get_user_config_dir(), "catgirldownloader")
         os.makedirs(self.directory, exist_ok=True)
         self.file = os.path.join(self.directory, "config.json")
         if not os.path.exists(self.file):
-            f = open(self.file, "w+")
-            f.write(json.dumps(self.preferences))
-            f.close()
+            self._write()
         try:
-            f = open(self.file, 'r')
-            self.preferences = json.loads(f.read())
-            f.close()
-            changed = False
-            for k, v in self._defaults.items():
-                if k not in self.preferences:
-                    self.preferences[k] = v
-                    changed = True
-            if changed:
+            self.preferences = self._read()
+            if any(k not in self.preferences for k in self._defaults):
                 self.set_preference_batch(self.preferences)
         except Exception as e:
             print(e)
 
+        self._monitor = Gio.File.new_for_path(self.file).monitor_file(Gio.FileMonitorFlags.NONE, None)
+        self._monitor.connect("changed", self._on_file_changed)
+
+    def _read(self):
+        f = open(self.file, 'r')
+        preferences = json.loads(f.read())
+        f.close()
+        for k, v in self._defaults.items():
+            if k not in preferences:
+                preferences[k] = v
+        return preferences
+
+    def _write(self):
+        try:
+            atomic_write(self.file, json.dumps(self.preferences).encode("utf-8"))
+        except Exception as e:
+            print(e)
+
+    def _on_file_changed(self, monitor, file, other_file, event_type):
+        if event_type not in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED):
+            return
+        if self._save_timeout_id is not None:
+            # Our own pending changes are newer, they will overwrite the file
+            return
+        self.reload_preferences()
+
     def reload_preferences(self):
         try:
-            f = open(self.file, 'r')
-            self.preferences = json.loads(f.read())
-            f.close()
-            for k, v in self._defaults.items():
-                if k not in self.preferences:
-                    self.preferences[k] = v
+            preferences = self._read()
         except Exception as e:
             print(e)
+            return
+        old = self.preferences
+        self.preferences = preferences
+        for key in set(old) | set(preferences):
+            if old.get(key) != preferences.get(key):
+                self.emit("changed::" + key, key)
 
     def get_preference(self, key):
-        self.reload_preferences()
         if key in self.preferences:
             return self.preferences[key]
         else:
             return None
+
     def set_preference(self, key, value):
+        if self.preferences.get(key) == value and key in self.preferences:
+            return
         self.preferences[key] = value
-        try:
-            f = open(self.file, "w+")
-            f.write(json.dumps(self.preferences))
-            f.close()
-        except Exception as e:
-            print(e)
+        self._schedule_save()
+        self.emit("changed::" + key, key)
 
     def set_preference_batch(self, prefs: dict):
+        old = self.preferences
         self.preferences = prefs
-        try:
-            f = open(self.file, "w+")
-            f.write(json.dumps(self.preferences))
-            f.close()
-        except Exception as e:
-            print(e)
+        self._schedule_save()
+        for key in prefs:
+            if old.get(key) != prefs.get(key):
+                self.emit("changed::" + key, key)
+
+    def _schedule_save(self):
+        if self._save_timeout_id is None:
+            self._save_timeout_id = GLib.timeout_add(SAVE_DELAY, self._on_save_timeout)
+
+    def _on_save_timeout(self):
+        self._save_timeout_id = None
+        self._write()
+        return False
+
+    def flush(self):
+        """Writes pending changes right away, call before exiting."""
+        if self._save_timeout_id is not None:
+            GLib.source_remove(self._save_timeout_id)
+            self._save_timeout_id = None
+            self._write()
@@ -1,6 +1,7 @@
 from gi.repository import Gtk, Adw
 from .preferences import UserPreferences
 from .types import NSFWOption
+from .slideshow import MIN_INTERVAL
 
 @Gtk.Template(resource_path='/moe/nyarchlinux/catgirldownloader/../data/ui/preferences.ui')
 class PreferencesWindow(Adw.PreferencesWindow):
@@ -8,11 +9,16 @@ class PreferencesWindow(Adw.PreferencesWindow):
 
     nsfw_dropdown = Gtk.Template.Child("nsfw_dropdown")
     auto_reload_seconds = Gtk.Template.Child("auto_reload_seconds")
+    progressive_switch = Gtk.Template.Child("progressive_switch")
+    hedge_switch = Gtk.Template.Child("hedge_switch")
+    prefetch_depth = Gtk.Template.Child("prefetch_depth")
+    prefetch_memory = Gtk.Template.Child("prefetch_memory")
+    cache_size = Gtk.Template.Child("cache_size")
 
     def __init__(self, window, **kwargs):
         super().__init__(**kwargs)
         self.window = window
-        self.settings = UserPreferences()
+        self.settings = UserPreferences.get_default()
 
         self._nsfw_options = [option.value for option in NSFWOption]
 
@@ -28,16 +34,47 @@ class PreferencesWindow(Adw.PreferencesWindow):
 
         self.nsfw_dropdown.connect("notify::selected", self.on_nsfw_change)
 
+        progressive = self.settings.get_preference("progressive_loading")
+        self.progressive_switch.set_active(progressive is not False)
+        self.progressive_switch.connect("notify::active", self.on_progressive_change)
+
+        self.hedge_switch.set_active(self.settings.get_preference("hedge_requests") is True)
+        self.hedge_switch.connect("notify::active", self.on_hedge_change)
+
         seconds = self.settings.get_preference("auto_reload_interval")
         try:
-            seconds = int(seconds) if seconds is not None else 30
+            seconds = float(seconds) if seconds is not None else 30
         except Exception:
             seconds = 30
-        if seconds < 1:
-            seconds = 1
+        if seconds < MIN_INTERVAL:
+            seconds = MIN_INTERVAL
         self.auto_reload_seconds.set_value(seconds)
         self.auto_reload_seconds.connect("value-changed", self.on_auto_reload_seconds_change)
 
+        depth = self.settings.get_preference("prefetch_depth")
+        try:
+            depth = int(depth) if depth is not None else 2
+        except Exception:
+            depth = 2
+        self.prefetch_depth.set_value(depth)
+        self.prefetch_depth.connect("value-changed", self.on_prefetch_change)
+
+        memory = self.settings.get_preference("prefetch_memory_mb")
+        try:
+            memory = int(memory) if memory is not None else 64
+        except Exception:
+            memory = 64
+        self.prefetch_memory.set_value(memory)
+        self.prefetch_memory.connect("value-changed", self.on_prefetch_change)
+
+        cache_size = self.settings.get_preference("cache_size_mb")
+        try:
+            cache_size = int(cache_size) if cache_size is not None else 256
+        except Exception:
+            cache_size = 256
+        self.cache_size.set_value(cache_size)
+        self.cache_size.connect("value-changed", self.on_cache_size_change)
+
     def on_nsfw_change(self, dropdown, _):
         index = dropdown.get_selected()
         if index is None or index < 0 or index >= len(self._nsfw_options):
@@ -45,11 +82,24 @@ class PreferencesWindow(Adw.PreferencesWindow):
         value = self._nsfw_options[index]
         self.settings.set_preference("nsfw_mode", value)
 
+    def on_progressive_change(self, switch, _):
+        self.settings.set_preference("progressive_loading", bool(switch.get_active()))
+
+    def on_hedge_change(self, switch, _):
+        self.settings.set_preference("hedge_requests", bool(switch.get_active()))
+
     def on_auto_reload_seconds_change(self, spin):
-        seconds = int(spin.get_value())
-        if seconds < 1:
-            seconds = 1
+        seconds = round(spin.get_value(), 1)
+        if seconds < MIN_INTERVAL:
+            seconds = MIN_INTERVAL
         self.settings.set_preference("auto_reload_interval", seconds)
-        if self.window is not None and hasattr(self.window, "set_auto_reload_interval"):
-            self.window.set_auto_reload_interval(seconds)
 
+    def on_prefetch_change(self, spin):
+        depth = int(self.prefetch_depth.get_value())
+        memory = int(self.prefetch_memory.get_value())
+        self.settings.set_preference("prefetch_depth", depth)
+        self.settings.set_preference("prefetch_memory_mb", memory)
+
+    def on_cache_size_change(self, spin):
+        megabytes = int(spin.get_value())
+        self.settings.set_preference("cache_size_mb", megabytes)
@@ -0,0 +1,188 @@
+import asyncio
+import concurrent.futures
+import threading
+from collections import deque
+from typing import Any, Callable, Hashable, Optional
+
+from .api_base import BaseDownloaderAPI
+from .async_engine import AsyncEngine, get_default_engine
+from .download import download
+from .executor import CancelledError, FetchExecutor, FetchToken, PRIORITY_USER, get_default_executor
+from .image_loader import DecodedImage, decode_texture
+from .metrics import get_default_metrics
+from .tracing import trace_async_span
+
+# Seconds between two checks whether the user's fetches are done
+USER_WAIT_INTERVAL = 0.1
+
+
+class PrefetchedImage:
+    """An image that has been downloaded and decoded ahead of time."""
+
+    def __init__(self, url: str, info: Optional[dict], content: bytes, image: DecodedImage, query_key: Hashable,
+                 max_size: Any = None) -> None:
+        self.url = url
+        self.info = info
+        self.content = content
+        self.image = image
+        self.query_key = query_key
+        self.max_size = max_size
+
+    @property
+    def size(self) -> int:
+        """Approximate memory used by this image, in bytes."""
+        return len(self.content) + (self.image.size if self.image else 0)
+
+
+class ImagePrefetcher:
+    """
+    Keeps up to `depth` ready-to-show images for a single downloader source.
+    Missing images are fetched by up to `concurrency` tasks on the async
+    engine, decoding runs on the engine's worker threads. A fetch only
+    starts while the executor has no user fetch queued or running, so
+    prefetching never competes with the image the user is waiting for.
+    """
+
+    def __init__(self, api: BaseDownloaderAPI, get_nsfw_mode: Callable[[], Any],
+                 depth: int = 2, max_bytes: int = 64 * 1024 * 1024,
+                 engine: Optional[AsyncEngine] = None,
+                 get_max_size: Optional[Callable[[], Any]] = None,
+                 executor: Optional[FetchExecutor] = None, concurrency: int = 2) -> None:
+        self.api = api
+        self.executor = executor if executor else get_default_executor()
+        self.concurrency = max(1, concurrency)
+        # Returns the (width, height) to decode images down to
+        self._get_max_size = get_max_size if get_max_size else lambda: None
+        self.engine = engine if engine else get_default_engine()
+        self._get_nsfw_mode = get_nsfw_mode
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self._queue: deque = deque()
+        self._lock = threading.Lock()
+        self._filling = False
+        # Fetches running for the current generation
+        self._in_flight = 0
+        # Bumped on every flush so that in-flight fetches started for an
+        # older query are dropped instead of being queued
+        self._generation = 0
+        # Cancelled on flush, stops the downloads of the current generation
+        self._token = FetchToken()
+        self._future: Optional[concurrent.futures.Future] = None
+
+    def set_limits(self, depth: int, max_bytes: int) -> None:
+        with self._lock:
+            self.depth = max(0, depth)
+            self.max_bytes = max(0, max_bytes)
+            while self._queue and (len(self._queue) > self.depth or self._queued_bytes() > self.max_bytes):
+                self._queue.pop()
+
+    def _queued_bytes(self) -> int:
+        return sum(image.size for image in self._queue)
+
+    def pop(self) -> Optional[PrefetchedImage]:
+        """Returns the next ready image for the current query, or None."""
+        query_key = self.api.get_query_key(self._get_nsfw_mode())
+        with self._lock:
+            if self._queue and self._queue[0].query_key != query_key:
+                self._flush_locked()
+            image = self._queue.popleft() if self._queue else None
+        self.refill()
+        return image
+
+    def has_ready(self) -> bool:
+        """Whether pop() would return an image right away."""
+        query_key = self.api.get_query_key(self._get_nsfw_mode())
+        with self._lock:
+            return bool(self._queue) and self._queue[0].query_key == query_key
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        self._queue.clear()
+        self._in_flight = 0
+        self._generation += 1
+        self._token.cancel()
+        self._token = FetchToken()
+        if self._future:
+            self._future.cancel()
+            self._future = None
+        self._filling = False
+
+    def refill(self) -> None:
+        """Starts a background fill if the queue has room."""
+        with self._lock:
+            if self._filling or not self._has_room_locked():
+                return
+            self._filling = True
+            self._future = self.engine.submit(self._fill(self._generation, self._token))
+
+    def _has_room_locked(self) -> bool:
+        # Images being fetched take a slot and are assumed as big as the queued ones
+        queued_bytes = self._queued_bytes()
+        expected = queued_bytes + self._in_flight * queued_bytes // len(self._queue) if self._queue else 0
+        return len(self._queue) + self._in_flight < self.depth and expected < self.max_bytes
+
+    async def _fill(self, generation: int, token: FetchToken) -> None:
+        """Runs the fetching tasks until the queue is full or the source stops delivering."""
+        try:
+            await asyncio.gather(*[self._fill_one(generation, token) for _ in range(self.concurrency)])
+        finally:
+            with self._lock:
+                if generation == self._generation:
+                    self._filling = False
+
+    async def _fill_one(self, generation: int, token: FetchToken) -> None:
+        while True:
+            # Wait for the user's fetches to finish before claiming a slot
+            while self.executor.busy(PRIORITY_USER):
+                await asyncio.sleep(USER_WAIT_INTERVAL)
+            with self._lock:
+                # The byte budget is checked before every fetch, not once per round
+                if generation != self._generation or not self._has_room_locked():
+                    return
+                self._in_flight += 1
+            nsfw_mode = self._get_nsfw_mode()
+            query_key = self.api.get_query_key(nsfw_mode)
+            image = None
+            try:
+                image = await self._fetch(nsfw_mode, query_key, self._get_max_size(), token)
+            except asyncio.CancelledError:
+                raise
+            except CancelledError:
+                # Flushed, the download was stopped
+                return
+            except Exception as e:
+                print(f"Error prefetching image: {e}")
+            finally:
+                with self._lock:
+                    if generation == self._generation:
+                        self._in_flight -= 1
+                        if image is not None and len(self._queue) < self.depth \
+                                and self._queued_bytes() < self.max_bytes:
+                            self._queue.append(image)
+            if image is None:
+                # Don't hammer a source that is failing
+                return
+
+    async def _fetch(self, nsfw_mode: Any, query_key: Hashable, max_size: Any,
+                     token: FetchToken) -> Optional[PrefetchedImage]:
+        source = self.api.source_id or type(self.api).__name__
+        with trace_async_span("prefetch", source=source):
+            limit = self.engine.limit
+            url, info = await self.api.fetch_next_url(nsfw_mode, limit)
+            if not url:
+                return None
+            loop = asyncio.get_running_loop()
+            metrics = get_default_metrics()
+            content = await loop.run_in_executor(None, self.api.cache.get, url)
+            if content is None:
+                with metrics.timer("prefetch_download", source=source):
+                    async with limit:
+                        content = await loop.run_in_executor(None, download, url, self.api.http, token)
+                metrics.observe("image", len(content), unit="bytes", source=source)
+                await loop.run_in_executor(None, self.api.cache.put, url, content)
+            with metrics.timer("prefetch_decode", source=source):
+                image = await loop.run_in_executor(None, decode_texture, content, max_size)
+            return PrefetchedImage(url, info, content, image, query_key, max_size)
@@ -0,0 +1,272 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from typing import Callable, List, Optional
+
+from .fileutils import atomic_write, get_user_cache_dir
+from .tracing import disable_tracing, enable_tracing
+
+# Comma separated modes, same syntax as the --profile option:
+#   cprofile              deterministic profile of the whole run
+#   sample[=ms]           sampling profiler, writes collapsed stacks for flame graphs
+#   tracemalloc[=n]       allocation snapshot every n-th reload, diffed against the previous one
+#   stalls[=ms]           logs main loop iterations longer than ms with the stack that blocked it
+#   trace                 Chrome trace-event timeline of every refresh, opens in Perfetto
+PROFILE_ENV = "CATGIRLDOWNLOADER_PROFILE"
+PROFILE_OPTION = "--profile"
+
+DEFAULT_SAMPLE_INTERVAL_MS = 5
+DEFAULT_TRACEMALLOC_EVERY = 10
+DEFAULT_STALL_THRESHOLD_MS = 100
+# Allocation sites listed per tracemalloc diff
+TRACEMALLOC_TOP = 25
+# Frames kept per tracemalloc trace
+TRACEMALLOC_FRAMES = 10
+
+
+def _parse_spec(spec: str) -> dict:
+    modes = {}
+    for part in spec.split(","):
+        name, _sep, value = part.strip().partition("=")
+        if not name:
+            continue
+        try:
+            modes[name] = float(value) if value else None
+        except ValueError:
+            print(f"Ignoring invalid value for profiling mode {name}: {value}")
+            modes[name] = None
+    return modes
+
+
+def _format_stack(frame) -> str:
+    return "".join(traceback.format_stack(frame))
+
+
+class _Sampler:
+    """Records the stacks of every thread at a fixed interval."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                functions = []
+                while frame is not None:
+                    code = frame.f_code
+                    functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                functions.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(functions))] += 1
+            self.samples += 1
+
+    def stop(self) -> str:
+        self._stopped.set()
+        self._thread.join()
+        # Collapsed stack format, readable by flamegraph.pl and speedscope
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class _StallDetector:
+    """
+    A timeout on the main loop updates a heartbeat; a watchdog thread that
+    finds it overdue by more than threshold grabs the main thread's stack,
+    which is the code blocking the loop.
+    """
+
+    def __init__(self, threshold: float, add_timeout: Callable) -> None:
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.stalls: List[dict] = []
+        self._main_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._current: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        add_timeout(max(1, int(self.interval * 1000)), self._beat)
+        self._thread = threading.Thread(target=self._watch, name="profile-stalls", daemon=True)
+        self._thread.start()
+
+    def _beat(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._current is not None:
+                self._current["duration_ms"] = (now - self._last_beat - self.interval) * 1000
+                self._current = None
+            self._last_beat = now
+        return not self._stopped.is_set()
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                late = time.monotonic() - self._last_beat - self.interval
+                if late < self.threshold or self._current is not None:
+                    continue
+                frame = sys._current_frames().get(self._main_thread)
+                self._current = {
+                    "time": time.time(),
+                    "duration_ms": late * 1000,
+                    "stack": _format_stack(frame) if frame else "",
+                }
+                self.stalls.append(self._current)
+
+    def stop(self) -> str:
+        self._stopped.set()
+        self._thread.join()
+        lines = [f"{len(self.stalls)} main loop stalls over {self.threshold * 1000:.0f} ms\n"]
+        for stall in self.stalls:
+            stamp = time.strftime("%H:%M:%S", time.localtime(stall["time"]))
+            lines.append(f"\n{stamp} blocked for {stall['duration_ms']:.0f} ms\n{stall['stack']}")
+        return "".join(lines)
+
+
+class Profiler:
+    """
+    Opt-in profiling of a whole session, enabled with the --profile option
+    or the CATGIRLDOWNLOADER_PROFILE environment variable. Results are
+    written to the profiles directory of the user cache dir by stop().
+    """
+
+    def __init__(self, spec: str, directory: Optional[str] = None) -> None:
+        self.modes = _parse_spec(spec)
+        self.directory = directory if directory else os.path.join(get_user_cache_dir(), "profiles")
+        self.prefix = time.strftime("%Y%m%d-%H%M%S")
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[_Sampler] = None
+        self._stalls: Optional[_StallDetector] = None
+        self._reloads = 0
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._tracemalloc_report: List[str] = []
+
+    def start(self) -> None:
+        unknown = set(self.modes) - {"cprofile", "sample", "tracemalloc", "stalls", "trace"}
+        if unknown:
+            print(f"Unknown profiling modes: {', '.join(sorted(unknown))}")
+        if "tracemalloc" in self.modes:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._snapshot = tracemalloc.take_snapshot()
+        if "sample" in self.modes:
+            self._sampler = _Sampler((self.modes["sample"] or DEFAULT_SAMPLE_INTERVAL_MS) / 1000)
+        if "trace" in self.modes:
+            enable_tracing()
+        if "cprofile" in self.modes:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def install_stall_detector(self, add_timeout: Callable) -> None:
+        """Starts stall detection, add_timeout being GLib.timeout_add of the main loop to watch."""
+        if "stalls" in self.modes and self._stalls is None:
+            self._stalls = _StallDetector((self.modes["stalls"] or DEFAULT_STALL_THRESHOLD_MS) / 1000, add_timeout)
+
+    def on_reload(self) -> None:
+        if self._snapshot is None:
+            return
+        self._reloads += 1
+        every = int(self.modes["tracemalloc"] or DEFAULT_TRACEMALLOC_EVERY)
+        if self._reloads % max(1, every):
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Reload {self._reloads}: {current / 1024:.0f} KiB traced, peak {peak / 1024:.0f} KiB"]
+        lines += [str(stat) for stat in snapshot.compare_to(self._snapshot, "lineno")[:TRACEMALLOC_TOP]]
+        self._tracemalloc_report.append("\n".join(lines) + "\n")
+        self._snapshot = snapshot
+
+    def stop(self) -> List[str]:
+        """Stops every mode and writes the results, returns the paths written."""
+        outputs = []
+        if self._profile is not None:
+            self._profile.disable()
+            stream = io.StringIO()
+            pstats.Stats(self._profile, stream=stream).sort_stats("cumulative").print_stats(50)
+            outputs.append(("cprofile.txt", stream.getvalue()))
+            path = self._path("cprofile.pstats")
+            self._profile.dump_stats(path)
+            print(f"Profile written to {path}")
+        if self._sampler is not None:
+            outputs.append(("samples.folded", self._sampler.stop()))
+        if self._stalls is not None:
+            outputs.append(("stalls.txt", self._stalls.stop()))
+        if self._snapshot is not None:
+            outputs.append(("tracemalloc.txt", "\n".join(self._tracemalloc_report)
+                            or f"Fewer than {int(self.modes['tracemalloc'] or DEFAULT_TRACEMALLOC_EVERY)} reloads\n"))
+            tracemalloc.stop()
+        tracer = disable_tracing()
+        if tracer is not None:
+            outputs.append(("trace.json", tracer.to_json()))
+
+        written = []
+        for name, text in outputs:
+            path = self._path(name)
+            try:
+                atomic_write(path, text.encode("utf-8"))
+            except Exception as e:
+                print(f"Error writing profile: {e}")
+                continue
+            print(f"Profile written to {path}")
+            written.append(path)
+        return written
+
+    def _path(self, name: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{self.prefix}-{name}")
+
+
+_active: Optional[Profiler] = None
+
+
+def start_profiling(argv: List[str]) -> Optional[Profiler]:
+    """
+    Starts profiling if --profile MODES (removed from argv, GTK would
+    reject it) or the environment variable asks for it.
+    """
+    global _active
+    spec = os.environ.get(PROFILE_ENV)
+    for i, arg in enumerate(argv):
+        if arg == PROFILE_OPTION and i + 1 < len(argv):
+            spec = argv[i + 1]
+            del argv[i:i + 2]
+            break
+        if arg.startswith(PROFILE_OPTION + "="):
+            spec = arg.split("=", 1)[1]
+            del argv[i]
+            break
+    if not spec:
+        return None
+    _active = Profiler(spec)
+    _active.start()
+    return _active
+
+
+def stop_profiling() -> None:
+    global _active
+    if _active is not None:
+        _active.stop()
+        _active = None
+
+
+def install_stall_detector(add_timeout: Callable) -> None:
+    if _active is not None:
+        _active.install_stall_detector(add_timeout)
+
+
+def profile_reload() -> None:
+    """Called on every reload, takes the tracemalloc snapshots."""
+    if _active is not None:
+        _active.on_reload()
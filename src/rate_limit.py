@@ -0,0 +1,177 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional, Tuple
+
+# (requests per second, burst) for hosts we know, others get DEFAULT_RATE
+HOST_RATES = {
+    "danbooru.donmai.us": (10, 10),
+    "api.waifu.im": (4, 8),
+    "nekos.moe": (2, 5),
+}
+DEFAULT_RATE = (20, 20)
+# Statuses that mean "slow down", retried after a backoff
+RETRY_STATUSES = (429, 502, 503, 504)
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+class RateLimitedError(IOError):
+    """Raised instead of waiting when a host won't accept requests for a long time."""
+
+    def __init__(self, host: str, seconds: float) -> None:
+        super().__init__(f"{host} is rate limited for {seconds:.0f} more seconds")
+        self.host = host
+        self.seconds = seconds
+
+
+class _HostState:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+        # Budget reported by the server, if it sends X-RateLimit-* headers
+        self.remaining: Optional[int] = None
+        self.limit: Optional[int] = None
+        self.reset_at: Optional[float] = None
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    """Returns the seconds until a rate limit window resets."""
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    # Some services send a Unix timestamp, others the seconds left
+    if reset > 1e9:
+        reset -= time.time()
+    return max(0.0, reset)
+
+
+class RateLimiter:
+    """
+    Token bucket per host, shared by every request the app makes.
+
+    Each request takes a token; when the bucket is empty callers wait for
+    the next one. Responses feed back into it: Retry-After and
+    X-RateLimit-* headers block the host until the server is ready again,
+    429 and 5xx responses without them back off exponentially with jitter.
+    """
+
+    def __init__(self, rates: Optional[Mapping[str, Tuple[float, int]]] = None,
+                 default_rate: Tuple[float, int] = DEFAULT_RATE) -> None:
+        self.rates = dict(HOST_RATES if rates is None else rates)
+        self.default_rate = default_rate
+        self._hosts: dict = {}
+        self._lock = threading.Lock()
+
+    def _get_state(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = _HostState(*self.rates.get(host, self.default_rate))
+            self._hosts[host] = state
+        return state
+
+    def reserve(self, host: str, max_wait: Optional[float] = None) -> float:
+        """
+        Takes a token for host and returns the seconds to wait before
+        sending the request. Raises RateLimitedError without taking a
+        token if that would be longer than max_wait.
+        """
+        with self._lock:
+            state = self._get_state(host)
+            now = time.monotonic()
+            state.refill(now)
+            delay = max(0.0, state.blocked_until - now)
+            if state.tokens < 1:
+                delay = max(delay, (1 - state.tokens) / state.rate)
+            if max_wait is not None and delay > max_wait:
+                raise RateLimitedError(host, delay)
+            # Tokens may go negative, later callers queue up behind this one
+            state.tokens -= 1
+            return delay
+
+    def update(self, host: str, status: int, headers: Mapping[str, str]) -> bool:
+        """Feeds a response back, returns True if the request should be retried."""
+        headers = {name.lower(): value for name, value in headers.items()}
+        with self._lock:
+            state = self._get_state(host)
+            now = time.monotonic()
+
+            remaining = headers.get("x-ratelimit-remaining") or headers.get("ratelimit-remaining")
+            limit = headers.get("x-ratelimit-limit") or headers.get("ratelimit-limit")
+            reset = headers.get("x-ratelimit-reset") or headers.get("ratelimit-reset")
+            if remaining is not None and remaining.strip().isdigit():
+                state.remaining = int(remaining)
+                state.limit = int(limit) if limit and limit.strip().isdigit() else state.limit
+                reset_seconds = _parse_reset(reset) if reset else None
+                state.reset_at = now + reset_seconds if reset_seconds is not None else None
+                if state.remaining == 0 and reset_seconds:
+                    state.blocked_until = max(state.blocked_until, now + reset_seconds)
+
+            if status not in RETRY_STATUSES:
+                state.failures = 0
+                return False
+
+            state.failures += 1
+            retry_after = _parse_retry_after(headers["retry-after"]) if "retry-after" in headers else None
+            if retry_after is None:
+                backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (state.failures - 1))
+                # Full jitter keeps clients that failed together from retrying together
+                retry_after = random.uniform(0, backoff)
+            state.blocked_until = max(state.blocked_until, now + retry_after)
+            return True
+
+    def budget(self, host: str) -> Optional[dict]:
+        """
+        Returns what is known about the budget left for host: "blocked"
+        seconds, and "remaining", "limit" and "reset" seconds if the
+        server reports them. None if nothing was sent to host yet.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                return None
+            now = time.monotonic()
+            if state.reset_at is not None and now >= state.reset_at:
+                # The window the server told us about is over
+                state.remaining = state.limit
+                state.reset_at = None
+            return {
+                "blocked": max(0.0, state.blocked_until - now),
+                "remaining": state.remaining,
+                "limit": state.limit,
+                "reset": max(0.0, state.reset_at - now) if state.reset_at is not None else None,
+            }
+
+
+_default_limiter: Optional[RateLimiter] = None
+_default_lock = threading.Lock()
+
+
+def get_default_limiter() -> RateLimiter:
+    """Limiter shared by clients that were not given one explicitly."""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Hashable, Optional
+
+
+class RecordBuffer:
+    """
+    Buffers image records returned by batched API calls.
+
+    Records are kept per query key. When the buffer for a key is empty the
+    caller fetches a batch synchronously; once it drops below `low_water`
+    a new batch is fetched on a background thread.
+
+    pop_async() is the asyncio counterpart, it shares the buffered records
+    and refills from a task on the running loop instead of a thread.
+    """
+
+    def __init__(self, fetch_batch: Callable[[Hashable], Optional[list]], low_water: int = 10) -> None:
+        self._fetch_batch = fetch_batch
+        self.low_water = low_water
+        self._buffers: dict = {}
+        # Key of the latest pop, batches for other keys are stale
+        self._current_key: Optional[Hashable] = None
+        self._refilling: set = set()
+        self._tasks: set = set()
+        self._lock = threading.Lock()
+
+    def pop(self, key: Hashable, max_attempts: int = 1) -> Optional[dict]:
+        record = self._pop_buffered(key)
+        attempts = 0
+        while record is None and attempts < max_attempts:
+            attempts += 1
+            batch = self._fetch_batch(key)
+            if batch is None:
+                # The request itself failed, retrying right away won't help
+                return None
+            self._extend(key, batch)
+            record = self._pop_buffered(key)
+        self._maybe_refill(key)
+        return record
+
+    async def pop_async(self, key: Hashable, fetch_batch: Callable[[Hashable], Awaitable[Optional[list]]],
+                        max_attempts: int = 1) -> Optional[dict]:
+        record = self._pop_buffered(key)
+        attempts = 0
+        while record is None and attempts < max_attempts:
+            attempts += 1
+            batch = await fetch_batch(key)
+            if batch is None:
+                return None
+            self._extend(key, batch)
+            record = self._pop_buffered(key)
+        if self._start_refill(key):
+            task = asyncio.get_running_loop().create_task(self._refill_async(key, fetch_batch))
+            # The loop only keeps weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return record
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buffers.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(buffer) for buffer in self._buffers.values())
+
+    def _pop_buffered(self, key: Hashable) -> Optional[dict]:
+        with self._lock:
+            self._current_key = key
+            buffer = self._buffers.get(key)
+            if buffer:
+                return buffer.popleft()
+            return None
+
+    def _extend(self, key: Hashable, batch: list) -> None:
+        with self._lock:
+            if key != self._current_key:
+                # A refill that finished after the query changed
+                return
+            # Only the latest query is worth keeping around
+            for other in [k for k in self._buffers if k != key]:
+                del self._buffers[other]
+            self._buffers.setdefault(key, deque()).extend(batch)
+
+    def _start_refill(self, key: Hashable) -> bool:
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None or len(buffer) >= self.low_water or key in self._refilling:
+                return False
+            self._refilling.add(key)
+            return True
+
+    def _maybe_refill(self, key: Hashable) -> None:
+        if not self._start_refill(key):
+            return
+        thread = threading.Thread(target=self._refill_thread, args=[key], daemon=True)
+        thread.start()
+
+    def _refill_thread(self, key: Hashable) -> None:
+        try:
+            batch = self._fetch_batch(key)
+            if batch:
+                self._extend(key, batch)
+        except Exception as e:
+            print(f"Error refilling records: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    async def _refill_async(self, key: Hashable, fetch_batch: Callable[[Hashable], Awaitable[Optional[list]]]) -> None:
+        try:
+            batch = await fetch_batch(key)
+            if batch:
+                self._extend(key, batch)
+        except Exception as e:
+            print(f"Error refilling records: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
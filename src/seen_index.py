@@ -0,0 +1,195 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+from typing import Any, Optional
+
+from .fileutils import atomic_write, get_user_cache_dir
+
+_MAGIC = b"CGSI"
+_HEADER = struct.Struct("<4sBIIII")
+_VERSION = 1
+# Seconds the index file waits for further additions before it is written
+SAVE_DELAY = 5.0
+DEFAULT_MEMORY_BYTES = 256 * 1024
+DEFAULT_FP_RATE = 0.01
+
+
+class _BloomFilter:
+    def __init__(self, bits: int, hashes: int, data: Optional[bytes] = None, count: int = 0) -> None:
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+        self.count = count
+
+    def _positions(self, key: bytes) -> list:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        # Double hashing, h2 made odd so it never degenerates to a single position
+        h2 |= 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.data[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: bytes) -> None:
+        for p in self._positions(key):
+            self.data[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class SeenIndex:
+    """
+    Remembers which images were already shown, in a fixed amount of memory.
+
+    Ids are stored in two Bloom filters: new ids go into the current one
+    and once it holds `capacity` ids the older one is dropped. Lookups check
+    both, so the most recent 1-2 x capacity ids are remembered with a false
+    positive rate of about fp_rate. The index is saved to the cache
+    directory. Without explicit sizes an existing file is loaded with the
+    sizes it was written with, so the batch command does not discard the
+    index of an app configured differently.
+    """
+
+    def __init__(self, path: Optional[str] = None, memory_bytes: Optional[int] = None,
+                 fp_rate: Optional[float] = None) -> None:
+        self.path = path if path else os.path.join(get_user_cache_dir(), "seen.bin")
+        self._adopt_file_sizes = memory_bytes is None and fp_rate is None
+        memory_bytes = memory_bytes if memory_bytes is not None else DEFAULT_MEMORY_BYTES
+        fp_rate = fp_rate if fp_rate is not None else DEFAULT_FP_RATE
+        self.fp_rate = min(0.5, max(1e-6, fp_rate))
+        # Each generation gets half the memory and half the false positive budget
+        self.bits = max(64, memory_bytes // 2 * 8)
+        per_filter_rate = self.fp_rate / 2
+        self.capacity = max(1, int(self.bits * math.log(2) ** 2 / -math.log(per_filter_rate)))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self.checks = 0
+        self.duplicates_skipped = 0
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        # Serializes file writes, which happen outside self._lock
+        self._save_lock = threading.Lock()
+        self._current = _BloomFilter(self.bits, self.hashes)
+        self._previous = _BloomFilter(self.bits, self.hashes)
+        self._load()
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> "SeenIndex":
+        def _get(key: str, default: float) -> float:
+            value = settings.get_preference(key) if settings else None
+            try:
+                return float(value) if value is not None else default
+            except Exception:
+                return default
+
+        return cls(memory_bytes=int(_get("seen_index_memory_kb", DEFAULT_MEMORY_BYTES // 1024) * 1024),
+                   fp_rate=_get("seen_index_fp_rate", DEFAULT_FP_RATE))
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Error reading seen image index: {e}")
+            return
+        try:
+            magic, version, bits, hashes, current_count, previous_count = _HEADER.unpack_from(data)
+        except struct.error:
+            return
+        if self._adopt_file_sizes and magic == _MAGIC and version == _VERSION and bits >= 64 and hashes >= 1 \
+                and len(data) == _HEADER.size + 2 * ((bits + 7) // 8):
+            self.bits = bits
+            self.hashes = hashes
+            self.capacity = max(1, int(bits * math.log(2) / hashes))
+            self.fp_rate = min(0.5, 2 * math.exp(-bits / self.capacity * math.log(2) ** 2))
+        size = (self.bits + 7) // 8
+        if magic != _MAGIC or version != _VERSION or bits != self.bits or hashes != self.hashes \
+                or len(data) != _HEADER.size + 2 * size:
+            # Written with other settings, start over
+            return
+        offset = _HEADER.size
+        self._current = _BloomFilter(bits, hashes, data[offset:offset + size], current_count)
+        self._previous = _BloomFilter(bits, hashes, data[offset + size:], previous_count)
+
+    def _mark_dirty(self) -> None:
+        """Schedules a write of the file, additions within SAVE_DELAY share it. Needs self._lock."""
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(SAVE_DELAY, self._save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save(self) -> None:
+        with self._save_lock:
+            with self._lock:
+                self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                header = _HEADER.pack(_MAGIC, _VERSION, self.bits, self.hashes,
+                                      self._current.count, self._previous.count)
+                data = header + bytes(self._current.data) + bytes(self._previous.data)
+            try:
+                atomic_write(self.path, data)
+            except Exception as e:
+                print(f"Error writing seen image index: {e}")
+
+    def __contains__(self, key: str) -> bool:
+        encoded = key.encode("utf-8")
+        with self._lock:
+            self.checks += 1
+            return encoded in self._current or encoded in self._previous
+
+    def add(self, key: str) -> bool:
+        """Records key as seen, returns False if it was (probably) seen before."""
+        encoded = key.encode("utf-8")
+        with self._lock:
+            self.checks += 1
+            if encoded in self._current or encoded in self._previous:
+                return False
+            if self._current.count >= self.capacity:
+                self._previous = self._current
+                self._current = _BloomFilter(self.bits, self.hashes)
+            self._current.add(encoded)
+            self._mark_dirty()
+            return True
+
+    def record_skipped(self, count: int) -> None:
+        """Counts downloads avoided because their image had been seen."""
+        with self._lock:
+            self.duplicates_skipped += count
+
+    def close(self) -> None:
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+        self._save()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checks": self.checks,
+                "duplicates_skipped": self.duplicates_skipped,
+                "entries": self._current.count + self._previous.count,
+                "capacity": self.capacity,
+                "fp_rate": self.fp_rate,
+                "bytes": len(self._current.data) + len(self._previous.data),
+            }
+
+
+_default_index: Optional[SeenIndex] = None
+_default_lock = threading.Lock()
+
+
+def get_default_seen_index() -> SeenIndex:
+    """Index used by sources that were not given one explicitly."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = SeenIndex()
+        return _default_index
@@ -0,0 +1,32 @@
+import math
+
+# Shortest interval between two slideshow images, in seconds
+MIN_INTERVAL = 0.5
+# Tolerance when placing a time on the tick grid, in seconds
+_EPSILON = 1e-6
+
+
+class SlideshowClock:
+    """
+    Deadlines of the auto reload slideshow. Tick n is due at
+    start + n * interval however long showing the previous image took,
+    so the period does not drift with the network. Ticks that can no
+    longer be met are skipped instead of piling up.
+    """
+
+    def __init__(self, interval: float, start: float) -> None:
+        self.reset(interval, start)
+
+    def reset(self, interval: float, start: float) -> None:
+        """Starts a new tick grid at start, the first tick being one interval later."""
+        self.interval = max(MIN_INTERVAL, interval)
+        self.start = start
+        self.skipped = 0
+        self._tick = 0
+
+    def next_deadline(self, earliest: float) -> float:
+        """Returns the deadline of the first upcoming tick that is not before earliest."""
+        tick = max(self._tick + 1, math.ceil((earliest - self.start) / self.interval - _EPSILON))
+        self.skipped += tick - self._tick - 1
+        self._tick = tick
+        return self.start + tick * self.interval
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# Latencies kept per source to compute the hedging deadline
+LATENCY_SAMPLES = 50
+# Deadline used until a source has this many samples
+MIN_SAMPLES = 5
+
+
+class LatencyTracker:
+    """
+    Remembers how long recent fetches from each source took and turns
+    that into a deadline: a fetch slower than the given percentile is
+    probably stuck and worth hedging.
+    """
+
+    def __init__(self, percentile: float = 0.9, default: float = 3.0,
+                 minimum: float = 0.5, maximum: float = 10.0) -> None:
+        self.percentile = percentile
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self._samples: dict = {}
+        self._lock = threading.Lock()
+
+    def record(self, source_id: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(source_id, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def estimate(self, source_id: str, percentile: Optional[float] = None) -> Optional[float]:
+        """Returns a percentile of the recent latencies of source_id, None until there are enough."""
+        with self._lock:
+            samples = sorted(self._samples.get(source_id, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        percentile = self.percentile if percentile is None else percentile
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def deadline(self, source_id: str) -> float:
+        """Returns the seconds to wait for source_id before hedging."""
+        value = self.estimate(source_id)
+        if value is None:
+            return self.default
+        return min(self.maximum, max(self.minimum, value))
+
+
+class CircuitBreaker:
+    """
+    Skips sources that keep failing. After `threshold` failures in a row
+    a source is left alone for `cooldown` seconds, then a single failure
+    is enough to open the circuit again until a fetch succeeds.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 60.0) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: dict = {}
+        self._open_until: dict = {}
+        self._lock = threading.Lock()
+
+    def allow(self, source_id: str) -> bool:
+        with self._lock:
+            return time.monotonic() >= self._open_until.get(source_id, 0)
+
+    def record_success(self, source_id: str) -> None:
+        with self._lock:
+            self._failures.pop(source_id, None)
+            self._open_until.pop(source_id, None)
+
+    def record_failure(self, source_id: str) -> None:
+        with self._lock:
+            failures = self._failures.get(source_id, 0) + 1
+            self._failures[source_id] = failures
+            if failures >= self.threshold:
+                self._open_until[source_id] = time.monotonic() + self.cooldown
@@ -0,0 +1,44 @@
+import importlib
+from typing import Any, Optional
+
+
+class SourceInfo:
+    """
+    Describes a downloader source without importing it. The API class is
+    imported the first time load_class() is called.
+    """
+
+    def __init__(self, id: str, name: str, description: str, module: str, class_name: str,
+                 icon: Optional[str] = None) -> None:
+        self.id = id
+        self.name = name
+        self.description = description
+        self.module = module
+        self.class_name = class_name
+        self.icon = icon
+        self._class = None
+
+    def load_class(self) -> Any:
+        if self._class is None:
+            module = importlib.import_module(f".{self.module}", __package__)
+            self._class = getattr(module, self.class_name)
+        return self._class
+
+    def create(self, **kwargs: Any) -> Any:
+        """Imports the source if needed and returns a new API instance."""
+        return self.load_class()(**kwargs)
+
+
+# Every downloader source, keyed by the id stored in the "source" preference.
+# Kept free of GTK imports so the batch CLI can use it.
+AVAILABLE_SOURCES = {
+    "catgirl": SourceInfo(
+        "catgirl", "Catgirl", "Generate images from nekos.moe.",
+        "catgirl", "CatgirlDownloaderAPI", "moe.nyarchlinux.catgirldownloader"),
+    "waifu": SourceInfo(
+        "waifu", "Waifu", "Generate images from waifu.im.",
+        "waifu", "WaifuDownloaderAPI", "moe.nyarchlinux.waifudownloader"),
+    "danbooru": SourceInfo(
+        "danbooru", "Danbooru", "Generate images from danbooru.donmai.us with custom tags.",
+        "danbooru", "DanbooruDownloaderAPI", "danbooru"),
+}
@@ -0,0 +1,17 @@
+import os
+import sys
+import time
+
+# Set to print startup milestones on stderr, read by benchmarks/startup_benchmark.py
+TRACE_ENV = "CATGIRLDOWNLOADER_STARTUP_TRACE"
+
+_enabled = bool(os.environ.get(TRACE_ENV))
+_seen = set()
+
+
+def startup_mark(event: str, once: bool = False) -> None:
+    """Prints `startup <event> <wall clock time>` when startup tracing is enabled."""
+    if not _enabled or (once and event in _seen):
+        return
+    _seen.add(event)
+    print(f"startup {event} {time.time():.6f}", file=sys.stderr, flush=True)
@@ -0,0 +1,87 @@
+import hashlib
+import os
+from typing import Callable, Iterable, Optional
+
+from gi.repository import Gdk, GLib
+
+from .executor import FetchExecutor, FetchToken, PRIORITY_BACKGROUND, PRIORITY_VISIBLE
+from .fileutils import atomic_write, get_user_cache_dir
+from .image_cache import ImageCache
+from .image_loader import decode_image
+
+# Longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = 192
+
+
+class ThumbnailCache:
+    """
+    Small PNG previews of shown images, stored on disk under the SHA-256
+    of their URL. Thumbnails are made and read on worker threads, a
+    missing one is generated from the image cache when its bytes are
+    still there.
+    """
+
+    def __init__(self, cache: ImageCache, executor: FetchExecutor, directory: Optional[str] = None) -> None:
+        self.cache = cache
+        self.executor = executor
+        self.directory = directory if directory else os.path.join(get_user_cache_dir(), "thumbnails")
+
+    def _path(self, url: str) -> str:
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name[:2], name + ".png")
+
+    def save(self, url: str, content: bytes) -> Optional[str]:
+        """Writes the thumbnail of content, returns its path. Runs on a worker thread."""
+        path = self._path(url)
+        if os.path.exists(path):
+            return path
+        try:
+            pixbuf = decode_image(content, (THUMBNAIL_SIZE, THUMBNAIL_SIZE)).get_pixbuf()
+            _ok, data = pixbuf.save_to_bufferv("png", [], [])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, data)
+        except Exception as e:
+            print(f"Error writing thumbnail: {e}")
+            return None
+        return path
+
+    def create_async(self, url: str, content: bytes) -> None:
+        """Makes the thumbnail of a freshly shown image in the background."""
+        self.executor.submit(lambda _token: self.save(url, content), priority=PRIORITY_BACKGROUND)
+
+    def load_async(self, url: str, callback: Callable, token: FetchToken) -> FetchToken:
+        """
+        Loads the thumbnail of url on a worker and calls callback on the
+        main thread with a Gdk.Texture, or None if there is none and the
+        image is no longer cached. Nothing is called once token is cancelled.
+        """
+        return self.executor.submit(self._load_thread, url, callback, priority=PRIORITY_VISIBLE, token=token)
+
+    def _load_thread(self, url: str, callback: Callable, token: FetchToken) -> None:
+        path = self._path(url)
+        if not os.path.exists(path):
+            content = self.cache.get(url)
+            token.check()
+            path = self.save(url, content) if content is not None else None
+        texture = None
+        if path:
+            try:
+                texture = Gdk.Texture.new_from_filename(path)
+            except Exception as e:
+                print(f"Error reading thumbnail: {e}")
+        GLib.idle_add(self._deliver, callback, texture, token)
+
+    def _deliver(self, callback: Callable, texture: Optional[Gdk.Texture], token: FetchToken) -> bool:
+        if not token.cancelled:
+            callback(texture)
+        return False
+
+    def remove(self, urls: Iterable[str]) -> None:
+        """Deletes the thumbnails of urls, for entries dropped from the history."""
+        for url in urls:
+            if not url:
+                continue
+            try:
+                os.unlink(self._path(url))
+            except OSError:
+                pass
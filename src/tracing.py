@@ -0,0 +1,138 @@
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Optional
+
+from .fileutils import atomic_write
+
+# Events kept before new ones are dropped, about 200 bytes each
+MAX_EVENTS = 500000
+
+
+class Tracer:
+    """
+    Records spans in the Chrome trace-event format, which Perfetto and
+    chrome://tracing open. Spans on one thread are complete ("X") events,
+    work that hops between threads, like a whole refresh, is an async
+    ("b"/"e") event pair sharing an id.
+
+    Times come from time.monotonic() so callers can hand in timestamps
+    taken on other threads.
+    """
+
+    def __init__(self, max_events: int = MAX_EVENTS) -> None:
+        self.max_events = max_events
+        self.dropped = 0
+        self._origin = time.monotonic()
+        self._pid = os.getpid()
+        self._events: list = []
+        self._threads: dict = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _ts(self, monotonic: float) -> float:
+        return (monotonic - self._origin) * 1e6
+
+    def _add(self, event: dict) -> None:
+        thread = threading.current_thread()
+        event["pid"] = self._pid
+        event["tid"] = thread.ident
+        with self._lock:
+            if len(self._events) >= self.max_events:
+                self.dropped += 1
+                return
+            self._threads.setdefault(thread.ident, thread.name)
+            self._events.append(event)
+
+    def new_id(self) -> int:
+        return next(self._ids)
+
+    def complete(self, name: str, start: float, end: Optional[float] = None, cat: str = "fetch", **args: Any) -> None:
+        """Records a span on the current thread from start to end, time.monotonic() values."""
+        end = time.monotonic() if end is None else end
+        self._add({"name": name, "cat": cat, "ph": "X", "ts": self._ts(start), "dur": (end - start) * 1e6,
+                   "args": args})
+
+    @contextmanager
+    def span(self, name: str, cat: str = "fetch", **args: Any):
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            self.complete(name, start, cat=cat, **args)
+
+    @contextmanager
+    def async_span(self, name: str, cat: str = "fetch", **args: Any):
+        """Like span() for coroutines, which interleave on the event loop thread."""
+        id = self.new_id()
+        self.async_begin(name, id, cat=cat, **args)
+        end_args = {}
+        try:
+            yield
+        except BaseException as e:
+            end_args["error"] = type(e).__name__
+            raise
+        finally:
+            self.async_end(name, id, cat=cat, **end_args)
+
+    def instant(self, name: str, cat: str = "fetch", **args: Any) -> None:
+        self._add({"name": name, "cat": cat, "ph": "i", "s": "t", "ts": self._ts(time.monotonic()), "args": args})
+
+    def async_begin(self, name: str, id: int, cat: str = "fetch", **args: Any) -> None:
+        self._add({"name": name, "cat": cat, "ph": "b", "id": id, "ts": self._ts(time.monotonic()), "args": args})
+
+    def async_end(self, name: str, id: int, cat: str = "fetch", **args: Any) -> None:
+        self._add({"name": name, "cat": cat, "ph": "e", "id": id, "ts": self._ts(time.monotonic()), "args": args})
+
+    def to_json(self) -> str:
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in threads.items()]
+        metadata.append({"name": "process_name", "ph": "M", "pid": self._pid, "tid": 0,
+                         "args": {"name": "catgirldownloader"}})
+        return json.dumps({"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                           "otherData": {"dropped_events": self.dropped}})
+
+    def save(self, path: str) -> None:
+        atomic_write(path, self.to_json().encode("utf-8"))
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable_tracing() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable_tracing() -> Optional[Tracer]:
+    """Stops recording and returns the tracer holding what was recorded."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    """Returns the tracer, None unless tracing was enabled."""
+    return _tracer
+
+
+def trace_span(name: str, **args: Any) -> ContextManager:
+    """Context manager recording a span when tracing is enabled, doing nothing otherwise."""
+    tracer = _tracer
+    return tracer.span(name, **args) if tracer is not None else nullcontext()
+
+
+def trace_async_span(name: str, **args: Any) -> ContextManager:
+    tracer = _tracer
+    return tracer.async_span(name, **args) if tracer is not None else nullcontext()
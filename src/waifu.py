@@ -1,50 +1,74 @@
-import requests
-import json
-from typing import Optional
+from typing import Any, Optional, Tuple
 
 from .types import NSFWOption
-from .api_base import BaseDownloaderAPI
+from .api_base import BatchedDownloaderAPI
+from .http_client import HttpClient
+from .image_cache import ImageCache
+from .seen_index import SeenIndex
 
-class WaifuDownloaderAPI(BaseDownloaderAPI):
-    def __init__(self, settings=None) -> None:
-        super().__init__()
+# Images requested per API call and buffered images that trigger a refill
+_BATCH_SIZE = 30
+_LOW_WATER_MARK = 5
+
+class WaifuDownloaderAPI(BatchedDownloaderAPI):
+    _low_water = _LOW_WATER_MARK
+    source_id = "waifu"
+
+    def __init__(self, settings=None, http: Optional[HttpClient] = None, cache: Optional[ImageCache] = None,
+                 seen: Optional[SeenIndex] = None) -> None:
+        super().__init__(http, cache, seen)
         self.endpoint = "https://api.waifu.im/images"
+        self.hosts = ["api.waifu.im", "cdn.waifu.im"]
 
-    def get_page(self, nsfw: Optional[bool] = None) -> Optional[str]:
-        try:
-            if nsfw is None:
-                params = {"IsNsfw": "All"}
-            elif nsfw:
-                params = {"IsNsfw": "True"}
-            else:
-                params = {"IsNsfw": "False"}
-            r = requests.get(self.endpoint, params=params, timeout=10)
-            if r.status_code == 200:
-                return r.text
-            else:
-                return None
-        except Exception as e:
-            print(e)
-            return None
+    def _page_params(self, nsfw: Optional[bool], page_size: int) -> dict:
+        if nsfw is None:
+            params = {"IsNsfw": "All"}
+        elif nsfw:
+            params = {"IsNsfw": "True"}
+        else:
+            params = {"IsNsfw": "False"}
+        params["PageSize"] = page_size
+        return params
 
-    def get_page_url(self, response: Optional[str]) -> Optional[str]:
-        if not response:
-            return None
+    def _record_key(self, nsfw_mode: NSFWOption) -> Optional[bool]:
+        nsfw = False
+        if nsfw_mode == NSFWOption.ONLY_NSFW or nsfw_mode == NSFWOption.ONLY_NSFW.value:
+            nsfw = True
+        elif nsfw_mode == NSFWOption.SHOW_EVERYTHING or nsfw_mode == NSFWOption.SHOW_EVERYTHING.value:
+            nsfw = None
+        return nsfw
+
+    def _batch_request(self, nsfw: Optional[bool]) -> Tuple[str, dict]:
+        return self.endpoint, self._page_params(nsfw, _BATCH_SIZE)
+
+    def _parse_batch(self, nsfw: Optional[bool], data: Any) -> Optional[list]:
         try:
-            data = json.loads(response)
-            self.info = data
-            return data["items"][0]['url']
+            items = [item for item in data["items"] if item.get('url')]
+            return items if items else None
         except Exception as e:
             print(e)
             return None
 
+    def _record_url(self, item: dict) -> str:
+        return item['url']
+
+    def _record_id(self, item: dict) -> Optional[str]:
+        return item.get('id') or item.get('url')
+
+    def _record_info(self, item: dict) -> dict:
+        # Keep the shape of a single-image API response for get_artist() and friends
+        return {"items": [item]}
+
+    def _info_record(self, info: dict) -> Optional[dict]:
+        items = info.get("items")
+        return items[0] if items else None
+
     def get_image_url(self, nsfw_mode: NSFWOption = NSFWOption.BLOCK_NSFW) -> Optional[str]:
-        nsfw = False
-        if nsfw_mode == NSFWOption.ONLY_NSFW or nsfw_mode == NSFWOption.ONLY_NSFW.value:
-            nsfw = True
-        elif nsfw_mode == NSFWOption.SHOW_EVERYTHING or nsfw_mode == NSFWOption.SHOW_EVERYTHING.value:
-            nsfw = None
-        return self.get_page_url(self.get_page(nsfw))
+        item = self._pop_record(nsfw_mode)
+        if item is None:
+            return None
+        self.info = self._record_info(item)
+        return item['url']
 
     def get_artist(self, info: Optional[dict] = None) -> Optional[str]:
         data = info if info else self.info
@@ -68,6 +92,18 @@ class WaifuDownloaderAPI(BaseDownloaderAPI):
         except Exception:
             return None
 
+    def get_history_info(self, info: Optional[dict] = None) -> Optional[dict]:
+        data = info if info else self.info
+        try:
+            item = data['items'][0]
+        except Exception:
+            return None
+        history_item = {key: item[key] for key in ('id', 'source') if key in item}
+        artists = item.get('artists')
+        if isinstance(artists, list) and artists:
+            history_item['artists'] = [{'name': artists[0].get('name')}]
+        return {'items': [history_item]}
+
     def get_filename_suggestion(self, extension: Optional[str], info: Optional[dict] = None) -> str:
         data = info if info else self.info
         try:
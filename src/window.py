@@ -17,118 +17,146 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import threading
-import requests
-from gi.repository import Gtk, Adw, GdkPixbuf, GLib, Gio, GObject
+import os
+import time
+from urllib.parse import urlsplit
+from gi.repository import Gtk, Adw, GLib, Gio, GObject
 
-from .catgirl import CatgirlDownloaderAPI
-from .waifu import WaifuDownloaderAPI
-from .danbooru import DanbooruDownloaderAPI
+from .sources import AVAILABLE_SOURCES
 from .preferences import UserPreferences
+from .image_loader import DecodedImage, decode_texture, load_image
+from .download import download
+from .prefetch import ImagePrefetcher
+from .http_client import HttpClient
+from .image_cache import ImageCache
+from .executor import CancelledError, FetchExecutor, FetchToken, PRIORITY_BACKGROUND, PRIORITY_USER
+from .async_engine import AsyncEngine
+from .source_health import CircuitBreaker, LatencyTracker
+from .seen_index import SeenIndex
+from .history import HistoryModel
+from .thumbnails import ThumbnailCache
+from .export import ExportJob
+from .fileutils import atomic_copy
+from .startup import startup_mark
+from .metrics import get_default_metrics
+from .profiling import profile_reload
+from .tracing import get_tracer, trace_span
+from .slideshow import MIN_INTERVAL, SlideshowClock
 
+# Seconds between an image being ready and it being on screen, added to
+# the fetch latency when deciding how early to load the next slideshow image
+SLIDESHOW_SLACK = 0.05
 
-def load_image_with_callback(url, callback, error_callback=None):
-    """
-    Load an image from URL and call the callback with the pixbuf loader when complete.
-    
-    Args:
-        url (str): The URL of the image to load
-        callback (callable): Function to call when image is loaded successfully.
-                           Should accept (pixbuf_loader, content_bytes) as argument
-        error_callback (callable, optional): Function to call on error.
-                                           Should accept (exception) as argument
-    """ 
-    def _load_image():
-        pixbuf_loader = GdkPixbuf.PixbufLoader()
-        data = bytearray()
-        try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            
-            for chunk in response.iter_content(chunk_size=1024):
-                data.extend(chunk)
-                pixbuf_loader.write(chunk)
-            
-            pixbuf_loader.close()
-            
-            # Schedule callback on main thread
-            GLib.idle_add(callback, pixbuf_loader, bytes(data))
-            
-        except Exception as e:
-            print(f"Exception loading image: {e}")
-            if error_callback:
-                GLib.idle_add(error_callback, e)
-    
-    # Run the loading in a separate thread to avoid blocking the UI
-    thread = threading.Thread(target=_load_image)
-    thread.daemon = True
-    thread.start()
 
 class SourceItem(GObject.Object):
     __gtype_name__ = 'SourceItem'
 
-    def __init__(self, id, name, description, api, icon=None):
+    def __init__(self, id, name, description, get_api, icon=None):
         super().__init__()
         self.id = id
         self.name = name
         self.description = description
-        self.api = api
+        self._get_api = get_api
         self.icon = icon
 
+    @property
+    def api(self):
+        # Sources are only imported and created once they are needed
+        return self._get_api(self.id)
+
 @Gtk.Template(resource_path='/moe/nyarchlinux/catgirldownloader/../data/ui/window.ui')
 class CatgirldownloaderWindow(Adw.ApplicationWindow):
     __gtype_name__ = 'CatgirldownloaderWindow'
 
     refresh_button = Gtk.Template.Child("refresh_button")
     spinner = Gtk.Template.Child("spinner")
-    image = Gtk.Template.Child("image")
+    progress_bar = Gtk.Template.Child("progress_bar")
+    budget_label = Gtk.Template.Child("budget_label")
+    image_stack = Gtk.Template.Child("image_stack")
+    front_picture = Gtk.Template.Child("front_picture")
+    back_picture = Gtk.Template.Child("back_picture")
     save_button = Gtk.Template.Child("savebutton")
     auto_reload_switch = Gtk.Template.Child("auto_reload_switch")
     source_selector = Gtk.Template.Child("source_selector")
+    history_button = Gtk.Template.Child("history_button")
+    history_revealer = Gtk.Template.Child("history_revealer")
+    history_view = Gtk.Template.Child("history_view")
+    export_progress = Gtk.Template.Child("export_progress")
+    toast_overlay = Gtk.Template.Child("toast_overlay")
 
-    AVAILABLE_SOURCES = {
-        "catgirl": {
-            "name": "Catgirl",
-            "description": "Generate images from nekos.moe.",
-            "class": CatgirlDownloaderAPI,
-            "icon": "moe.nyarchlinux.catgirldownloader"
-        },
-        "waifu": {
-            "name": "Waifu",
-            "description": "Generate images from waifu.im.",
-            "class": WaifuDownloaderAPI,
-            "icon": "moe.nyarchlinux.waifudownloader"
-        },
-        "danbooru": {
-            "name": "Danbooru",
-            "description": "Generate images from danbooru.donmai.us with custom tags.",
-            "class": DanbooruDownloaderAPI,
-            "icon": "danbooru"
-        }
-    }
-
-    def __init__(self, **kwargs):
+    AVAILABLE_SOURCES = AVAILABLE_SOURCES
+
+    def __init__(self, http=None, cache=None, executor=None, engine=None, seen=None, history=None, **kwargs):
         super().__init__(**kwargs)
-        self.settings = UserPreferences()
+        startup_mark("window-init")
+        self.settings = UserPreferences.get_default()
+        self.http = http if http else HttpClient.from_settings(self.settings)
+        self.cache = cache if cache else ImageCache.from_settings(self.settings)
+        self.executor = executor if executor else FetchExecutor.from_settings(self.settings)
+        self.engine = engine if engine else AsyncEngine.from_settings(self.settings, self.http)
+        self.seen = seen if seen else SeenIndex.from_settings(self.settings)
+        self.history = history if history else HistoryModel()
+        self.thumbnails = ThumbnailCache(self.cache, self.executor)
+        # Size images are decoded to, kept up to date by do_size_allocate so
+        # worker threads never have to query widgets
+        self._display_size = (self.get_default_size()[0] * self.get_scale_factor(),
+                              self.get_default_size()[1] * self.get_scale_factor())
+        self._decode_size = None
+        self._redecode_timeout_id = None
+        # Whether a partial frame of the image being loaded is already shown
+        self._progress_shown = False
 
         self.downloaders = {}
-        self.source_store = Gio.ListStore(item_type=SourceItem)
-        
+        self.prefetchers = {}
+
+        self.info = None
+        self.imagecontent = None
+        self.image_extension = None
+        self.image_url = None
+        self._image_source_id = None
+        # (url, content) of the full original when a smaller variant is shown
+        self._original = None
+        # (url, callbacks) of the original being downloaded
+        self._original_fetch = None
+
+        self._is_loading = False
+        self._fetch_token = None
+        # Id of the refresh in the trace, when tracing
+        self._trace_id = None
+        # Hedging state of the current reload, see _reload()
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self._hedge_timeout_id = None
+        self._hedged = False
+        self._pending_attempts = 0
+        self._auto_reload_timeout_id = None
+        self._budget_timeout_id = None
+        self._export_job = None
+        self._auto_reload_interval = self._get_auto_reload_interval()
+        self._slideshow = SlideshowClock(self._auto_reload_interval, time.monotonic())
+        # Tick the image being loaded is due on, None unless the slideshow started the load
+        self._slideshow_deadline = None
+        # Timeout showing an image that was ready before its tick, and that image
+        self._held_image_id = None
+        self._held_image = None
+
         saved_source = self.settings.get_preference("source")
-        default_index = 0
-        found_source = False
+        if saved_source not in self.AVAILABLE_SOURCES:
+            saved_source = next(iter(self.AVAILABLE_SOURCES))
+        self._current_source_id = saved_source
 
-        for i, (key, value) in enumerate(self.AVAILABLE_SOURCES.items()):
-            api = value["class"](settings=self.settings)
-            self.downloaders[key] = api
-            item = SourceItem(key, value["name"], value.get("description", ""), api, value.get("icon"))
+        # Send the first request before building the rest of the UI, only
+        # the selected source gets imported at this point
+        self.http.warm_up(self.get_downloader(saved_source).hosts)
+        self._reload(saved_source)
+
+        self.source_store = Gio.ListStore(item_type=SourceItem)
+        default_index = 0
+        for i, (key, source) in enumerate(self.AVAILABLE_SOURCES.items()):
+            item = SourceItem(key, source.name, source.description, self.get_downloader, source.icon)
             self.source_store.append(item)
             if key == saved_source:
                 default_index = i
-                found_source = True
-        
-        if not found_source and self.source_store.get_n_items() > 0:
-            default_index = 0
 
         self.source_selector.set_model(self.source_store)
         
@@ -150,21 +178,121 @@ class CatgirldownloaderWindow(Adw.ApplicationWindow):
         self.source_selector.set_selected(default_index)
         self.source_selector.connect("notify::selected-item", self.on_source_changed)
 
-        self.info = None
-        self.imagecontent = None
-        self.image_extension = None
-
-        self._is_loading = False
-        self._auto_reload_timeout_id = None
-        self._auto_reload_interval = self._get_auto_reload_interval()
-
         enabled = self._get_auto_reload_enabled()
         self.auto_reload_switch.set_active(enabled)
         self.auto_reload_switch.connect("notify::active", self.on_auto_reload_toggle)
 
+        self.settings.connect("changed", self._on_setting_changed)
+
+        self._setup_history()
+        self.image_stack.connect("notify::transition-running", lambda *_: self._drop_hidden_image())
+
         self.refresh_button.connect("clicked", self.async_reloadimage)
         self.save_button.connect("clicked", self.file_chooser_dialog)
-        self.async_reloadimage()
+        self.connect("map", lambda *_: startup_mark("window-mapped", once=True))
+
+    def get_downloader(self, source_id):
+        """Returns the API for source_id, importing and creating it on first use."""
+        api = self.downloaders.get(source_id)
+        if api is None:
+            api = self.AVAILABLE_SOURCES[source_id].create(settings=self.settings, http=self.http, cache=self.cache,
+                                                           seen=self.seen)
+            api.display_size = self._display_size
+            self.downloaders[source_id] = api
+            self.prefetchers[source_id] = ImagePrefetcher(
+                api, self._get_nsfw_mode, self._get_prefetch_depth(), self._get_prefetch_memory_mb() * 1024 * 1024,
+                self.engine, self._get_display_size, self.executor)
+        return api
+
+    def _setup_history(self):
+        if self.history.loaded:
+            self._remove_dropped_thumbnails()
+        else:
+            self.history.connect("loaded", lambda _model: self._remove_dropped_thumbnails())
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.setup_history_item)
+        factory.connect("bind", self.bind_history_item)
+        factory.connect("unbind", self.unbind_history_item)
+        self.history_view.set_factory(factory)
+        self.history_view.set_model(Gtk.NoSelection(model=self.history))
+        self.history_view.connect("activate", self.on_history_activate)
+        self.history_button.bind_property("active", self.history_revealer, "reveal-child",
+                                          GObject.BindingFlags.SYNC_CREATE)
+
+    def _remove_dropped_thumbnails(self):
+        if self.history.dropped_urls:
+            dropped, self.history.dropped_urls = self.history.dropped_urls, []
+            self.executor.submit(lambda _token: self.thumbnails.remove(dropped), priority=PRIORITY_BACKGROUND)
+
+    def setup_history_item(self, factory, list_item):
+        picture = Gtk.Picture(content_fit=Gtk.ContentFit.COVER, can_shrink=True)
+        picture.set_size_request(120, 120)
+        list_item.set_child(picture)
+
+    def bind_history_item(self, factory, list_item):
+        # Only rows GTK binds, the visible ones, get their thumbnail loaded
+        picture = list_item.get_child()
+        item = list_item.get_item()
+        picture.set_paintable(None)
+        if not item or not item.url:
+            return
+        token = FetchToken()
+        list_item._thumbnail_token = token
+
+        def on_thumbnail(texture):
+            if list_item.get_item() is item:
+                picture.set_paintable(texture)
+
+        self.thumbnails.load_async(item.url, on_thumbnail, token)
+
+    def unbind_history_item(self, factory, list_item):
+        token = getattr(list_item, "_thumbnail_token", None)
+        if token:
+            token.cancel()
+            list_item._thumbnail_token = None
+        list_item.get_child().set_paintable(None)
+
+    def on_history_activate(self, view, position):
+        item = self.history.get_item(position)
+        if not item or not item.url:
+            return
+        self._cancel_current_fetch()
+        self._is_loading = True
+        self._progress_shown = False
+        self._trace_refresh_begin(item.source_id, "history")
+        self._cancel_auto_reload()
+        self.spinner.set_visible(True)
+        self.spinner.start()
+        source_id = item.source_id if item.source_id in self.AVAILABLE_SOURCES else None
+        if source_id:
+            self.get_downloader(source_id)
+        self._fetch_token = self.executor.new_generation("display")
+        self.executor.submit(self._load_history_thread, item, source_id, self._display_size,
+                             priority=PRIORITY_USER, token=self._fetch_token)
+
+    def _load_history_thread(self, item, source_id, max_size, token):
+        try:
+            # Served from the image cache while its bytes are still there
+            loader, data = load_image(item.url, self.http, self.cache, token, max_size)
+            image = DecodedImage.from_loader(loader)
+            GLib.idle_add(self._on_history_loaded, token, image, data, item, source_id, max_size)
+        except CancelledError:
+            pass
+        except Exception as e:
+            GLib.idle_add(self._on_history_failed, token, e)
+
+    def _on_history_loaded(self, token, image, content, item, source_id, max_size):
+        if self._is_current_fetch(token):
+            self._fetch_token = None
+            self._on_image_loaded(image, content, item.info, max_size, item.url, source_id, add_to_history=False)
+        return False
+
+    def _on_history_failed(self, token, error):
+        if self._is_current_fetch(token):
+            self._fetch_token = None
+            self._on_image_error(error)
+        return False
 
     def setup_source_button_item(self, factory, list_item):
         label = Gtk.Label(halign=Gtk.Align.START)
@@ -253,9 +381,97 @@ class CatgirldownloaderWindow(Adw.ApplicationWindow):
     def on_source_changed(self, dropdown, _pspec):
         item = dropdown.get_selected_item()
         if item:
+            previous = self.prefetchers.get(self._current_source_id)
+            if previous and self._current_source_id != item.id:
+                previous.flush()
+            self._current_source_id = item.id
             self.settings.set_preference("source", item.id)
+            # The image being loaded is for the old source, drop it
+            self._cancel_current_fetch()
             self.async_reloadimage()
 
+    def _get_selected_source_id(self):
+        source_id = None
+        item = self.source_selector.get_selected_item()
+        if item:
+            source_id = item.id
+
+        if not source_id:
+            # Fallback if no selection
+            if self.source_store.get_n_items() > 0:
+                source_id = self.source_store.get_item(0).id
+
+        # Should not happen if store populated, but handle safely
+        if not source_id:
+             source_id = self._current_source_id or next(iter(self.AVAILABLE_SOURCES))
+        return source_id
+
+    def _get_nsfw_mode(self):
+        return self.settings.get_preference("nsfw_mode")
+
+    def on_nsfw_mode_changed(self):
+        for prefetcher in self.prefetchers.values():
+            prefetcher.flush()
+        prefetcher = self.prefetchers.get(self._current_source_id)
+        if prefetcher:
+            prefetcher.refill()
+
+    def _get_prefetch_depth(self) -> int:
+        depth = self.settings.get_preference("prefetch_depth")
+        try:
+            depth = int(depth) if depth is not None else 2
+        except Exception:
+            depth = 2
+        return max(0, depth)
+
+    def _get_prefetch_memory_mb(self) -> int:
+        megabytes = self.settings.get_preference("prefetch_memory_mb")
+        try:
+            megabytes = int(megabytes) if megabytes is not None else 64
+        except Exception:
+            megabytes = 64
+        return max(0, megabytes)
+
+    def _get_cache_size_mb(self) -> int:
+        megabytes = self.settings.get_preference("cache_size_mb")
+        try:
+            megabytes = int(megabytes) if megabytes is not None else 256
+        except Exception:
+            megabytes = 256
+        return max(0, megabytes)
+
+    def set_prefetch_limits(self, depth: int, memory_mb: int):
+        for prefetcher in self.prefetchers.values():
+            prefetcher.set_limits(depth, memory_mb * 1024 * 1024)
+        prefetcher = self.prefetchers.get(self._current_source_id)
+        if prefetcher and not self._is_loading:
+            prefetcher.refill()
+
+    def _on_setting_changed(self, settings, key):
+        if key == "nsfw_mode":
+            self.on_nsfw_mode_changed()
+        elif key == "danbooru_tags":
+            prefetcher = self.prefetchers.get("danbooru")
+            if prefetcher:
+                prefetcher.flush()
+        elif key in ("prefetch_depth", "prefetch_memory_mb"):
+            self.set_prefetch_limits(self._get_prefetch_depth(), self._get_prefetch_memory_mb())
+        elif key == "cache_size_mb":
+            self.cache.set_max_bytes(self._get_cache_size_mb() * 1024 * 1024)
+        elif key == "auto_reload_interval":
+            self.set_auto_reload_interval(self._get_auto_reload_interval())
+        elif key == "auto_reload_enabled":
+            self.auto_reload_switch.set_active(self._get_auto_reload_enabled())
+        elif key == "source":
+            for i in range(self.source_store.get_n_items()):
+                if self.source_store.get_item(i).id == settings.get_preference("source"):
+                    if self.source_selector.get_selected() != i:
+                        self.source_selector.set_selected(i)
+                    break
+
+    def _get_progressive_enabled(self) -> bool:
+        return self.settings.get_preference("progressive_loading") is not False
+
     def _get_auto_reload_enabled(self) -> bool:
         enabled = self.settings.get_preference("auto_reload_enabled")
         if isinstance(enabled, bool):
@@ -264,25 +480,26 @@ class CatgirldownloaderWindow(Adw.ApplicationWindow):
             return enabled.lower() in ("1", "true", "yes", "on")
         return False
 
-    def _get_auto_reload_interval(self) -> int:
+    def _get_auto_reload_interval(self) -> float:
         seconds = self.settings.get_preference("auto_reload_interval")
         try:
-            seconds = int(seconds) if seconds is not None else 30
+            seconds = float(seconds) if seconds is not None else 30
         except Exception:
             seconds = 30
-        if seconds < 1:
-            seconds = 1
+        if seconds < MIN_INTERVAL:
+            seconds = MIN_INTERVAL
         return seconds
 
-    def set_auto_reload_interval(self, seconds: int):
+    def set_auto_reload_interval(self, seconds: float):
         try:
-            seconds = int(seconds)
+            seconds = float(seconds)
         except Exception:
             seconds = 30
-        if seconds < 1:
-            seconds = 1
+        if seconds < MIN_INTERVAL:
+            seconds = MIN_INTERVAL
         self._auto_reload_interval = seconds
         self.settings.set_preference("auto_reload_interval", seconds)
+        self._slideshow.reset(seconds, time.monotonic())
         if self.auto_reload_switch.get_active() and not self._is_loading:
             self._schedule_next_auto_reload()
 
@@ -292,6 +509,7 @@ class CatgirldownloaderWindow(Adw.ApplicationWindow):
         if not active:
             self._cancel_auto_reload()
             return
+        self._slideshow.reset(self._auto_reload_interval, time.monotonic())
         if not self._is_loading:
             self._schedule_next_auto_reload()
 
@@ -305,102 +523,423 @@ class CatgirldownloaderWindow(Adw.ApplicationWindow):
             return
         self._cancel_auto_reload()
 
-        seconds = int(self._auto_reload_interval) if self._auto_reload_interval else 30
-        if seconds < 1:
-            seconds = 1
+        # Loading starts early enough for the image to be ready on the tick,
+        # and not before the API accepts requests again
+        now = time.monotonic()
+        lead = self._get_slideshow_lead(self._get_selected_source_id())
+        skipped = self._slideshow.skipped
+        deadline = self._slideshow.next_deadline(now + self._get_rate_limit_wait() + lead)
+        if self._slideshow.skipped > skipped:
+            get_default_metrics().increment("slideshow_skipped", self._slideshow.skipped - skipped)
 
-        self._auto_reload_timeout_id = GLib.timeout_add_seconds(
-            seconds,
+        self._auto_reload_timeout_id = GLib.timeout_add(
+            max(0, int((deadline - lead - now) * 1000)),
             self._on_auto_reload_timeout,
+            deadline,
         )
+        tracer = get_tracer()
+        if tracer:
+            tracer.instant("auto_reload_scheduled", seconds=deadline - now, lead=lead)
+
+    def _get_slideshow_lead(self, source_id):
+        """Returns how many seconds before a tick the next image should start loading."""
+        prefetcher = self.prefetchers.get(source_id)
+        if prefetcher and prefetcher.has_ready():
+            return SLIDESHOW_SLACK
+        estimate = self.latency.estimate(source_id) if source_id else None
+        return (estimate if estimate is not None else self.latency.default) + SLIDESHOW_SLACK
 
-    def _on_auto_reload_timeout(self):
+    def _on_auto_reload_timeout(self, deadline):
         self._auto_reload_timeout_id = None
-        if not self.auto_reload_switch.get_active():
+        tracer = get_tracer()
+        if tracer:
+            tracer.instant("auto_reload_timer", loading=self._is_loading)
+        if not self.auto_reload_switch.get_active() or self._is_loading:
             return False
+        self._slideshow_deadline = deadline
         self.async_reloadimage()
         return False
 
     def async_reloadimage(self, az=None):
         """Call the function to load the image on another thread
         """
+        if self._held_image_id is not None:
+            # The next image is already there, waiting for its tick
+            self._show_held_image()
+            return
         if self._is_loading:
             return
+        profile_reload()
+        self._reload(self._get_selected_source_id())
+
+    def _reload(self, source_id):
         self._is_loading = True
+        self._progress_shown = False
+        self._trace_refresh_begin(source_id)
         self._cancel_auto_reload()
         self.spinner.set_visible(True)
         self.spinner.start()
 
-        source_id = None
-        item = self.source_selector.get_selected_item()
-        if item:
-            source_id = item.id
+        self.get_downloader(source_id)
+        prefetcher = self.prefetchers.get(source_id)
+        prefetched = prefetcher.pop() if prefetcher else None
+        tracer = get_tracer()
+        if tracer:
+            tracer.instant("prefetch_hit" if prefetched else "prefetch_miss", source=source_id)
+        if prefetched:
+            self._on_image_loaded(prefetched.image, prefetched.content, prefetched.info, prefetched.max_size,
+                                  prefetched.url, source_id)
+            return
 
-        if not source_id:
-            # Fallback if no selection
-            if self.source_store.get_n_items() > 0:
-                source_id = self.source_store.get_item(0).id
-        
-        # Should not happen if store populated, but handle safely
-        if not source_id and self.downloaders:
-             source_id = next(iter(self.downloaders))
+        self._fetch_token = self.executor.new_generation("display")
+        self._pending_attempts = 0
+        self._hedged = False
+        hedging = self._get_hedging_enabled()
+        if hedging and not self.breaker.allow(source_id):
+            # The source keeps failing, go straight to another one
+            source_id = self._get_fallback_source(source_id) or source_id
+        # Slideshow images are only shown on their tick, partial frames would give them away
+        self._start_attempt(source_id, self._get_progressive_enabled() and self._slideshow_deadline is None)
+        if hedging:
+            deadline = self.latency.deadline(source_id)
+            self._hedge_timeout_id = GLib.timeout_add(int(deadline * 1000), self._on_hedge_deadline,
+                                                      self._fetch_token, source_id)
 
-        t = threading.Thread(target=self._fetch_url_thread, args=[source_id], daemon=True)
-        t.start()
+    def _trace_refresh_begin(self, source_id, trigger="reload"):
+        tracer = get_tracer()
+        if tracer:
+            self._trace_id = tracer.new_id()
+            tracer.async_begin("refresh", self._trace_id, source=source_id, trigger=trigger)
 
-    def _fetch_url_thread(self, source_id=None):
-        try:
-            if not source_id:
-                source_id = next(iter(self.downloaders))
+    def _trace_refresh_end(self, outcome):
+        tracer = get_tracer()
+        if tracer and self._trace_id is not None:
+            tracer.async_end("refresh", self._trace_id, outcome=outcome)
+        self._trace_id = None
 
-            ct = self.downloaders.get(source_id)
-            if not ct:
-                ct = self.downloaders[next(iter(self.downloaders))]
-                
-            nsfw_mode_setting = self.settings.get_preference("nsfw_mode")
-            url = ct.get_image_url(nsfw_mode_setting) if nsfw_mode_setting is not None else ct.get_image_url()
-            info = getattr(ct, "info", None)
-            
-            if url:
-                load_image_with_callback(
-                    url, 
-                    lambda loader, data: self._on_image_loaded(loader, data, info), 
-                    self._on_image_error
-                )
-            else:
-                 GLib.idle_add(self._on_image_error, Exception("Could not retrieve image URL"))
-        except Exception as e:
-            print(f"Error fetching URL: {e}")
-            GLib.idle_add(self._on_image_error, e)
+    def _get_hedging_enabled(self) -> bool:
+        return self.settings.get_preference("hedge_requests") is True
 
-    def _on_image_loaded(self, loader, content, info):
-        try:
-            self.info = info
-            self.imagecontent = content
+    def _get_fallback_source(self, source_id):
+        """Returns the first other source that is not failing, or None."""
+        for other in self.AVAILABLE_SOURCES:
+            if other != source_id and self.breaker.allow(other):
+                return other
+        return None
+
+    def _start_attempt(self, source_id, progressive):
+        self.get_downloader(source_id)
+        self._pending_attempts += 1
+        self.executor.submit(self._fetch_url_thread, source_id, self._display_size, progressive, time.monotonic(),
+                             priority=PRIORITY_USER, token=self._fetch_token)
+
+    def _on_hedge_deadline(self, token, source_id):
+        """The first attempt is slower than usual, race it against a second one."""
+        self._hedge_timeout_id = None
+        if self._is_current_fetch(token) and not self._hedged:
+            self._hedged = True
+            # Asking the same source again only helps if it is slow, not down
+            fallback = self._get_fallback_source(source_id) or source_id
+            tracer = get_tracer()
+            if tracer:
+                tracer.instant("hedge", source=source_id, fallback=fallback)
+            self._start_attempt(fallback, False)
+        return False
+
+    def _cancel_hedge(self):
+        if self._hedge_timeout_id is not None:
+            GLib.source_remove(self._hedge_timeout_id)
+            self._hedge_timeout_id = None
+
+    def _cancel_current_fetch(self):
+        self._slideshow_deadline = None
+        if self._held_image_id is not None:
+            GLib.source_remove(self._held_image_id)
+            self._held_image_id = None
+            self._held_image = None
+            self._is_loading = False
+            self._trace_refresh_end("cancelled")
+        if self._fetch_token is None:
+            return
+        self.executor.cancel("display")
+        self._fetch_token = None
+        self._cancel_hedge()
+        if self._is_loading:
+            self.spinner.stop()
+            self.spinner.set_visible(False)
+            self._hide_progress()
+            self._is_loading = False
+            self._trace_refresh_end("cancelled")
+
+    def _fetch_url_thread(self, source_id=None, max_size=None, progressive=False, started=None, token=None):
+        with trace_span("fetch", source=source_id):
+            metrics = get_default_metrics()
+            try:
+                # Created by _reload() on the main thread
+                ct = self.downloaders[source_id]
+
+                url, info = ct.get_image_url_with_info(self._get_nsfw_mode())
+                if token:
+                    token.check()
+
+                if url:
+                    on_update = None
+                    if progressive:
+                        def on_update(frame, received, total):
+                            GLib.idle_add(self._on_fetch_progress, token, frame, received, total)
+                    loader, data = load_image(url, ct.http, ct.cache, token, max_size, on_update, source=source_id)
+                    # The main thread only swaps the texture in
+                    image = DecodedImage.from_loader(loader)
+                    metrics.observe("fetch", time.monotonic() - started, source=source_id)
+                    GLib.idle_add(self._on_fetch_done, token, image, data, info, max_size, url, source_id, started,
+                                  time.monotonic())
+                else:
+                     metrics.increment("errors", stage="fetch", error="NoImageURL", source=source_id)
+                     GLib.idle_add(self._on_fetch_failed, token, Exception("Could not retrieve image URL"), source_id)
+            except CancelledError:
+                metrics.increment("cancelled", source=source_id)
+            except Exception as e:
+                print(f"Error fetching URL: {e}")
+                metrics.increment("errors", stage="fetch", error=type(e).__name__, source=source_id)
+                GLib.idle_add(self._on_fetch_failed, token, e, source_id)
+
+    def _is_current_fetch(self, token):
+        return token is not None and token is self._fetch_token and not token.cancelled
+
+    def _on_fetch_progress(self, token, frame, received, total):
+        if not self._is_current_fetch(token):
+            return False
+        self.progress_bar.set_visible(True)
+        if total:
+            self.progress_bar.set_fraction(received / total)
+        else:
+            self.progress_bar.pulse()
+        if frame is not None:
+            self._present(frame, new_image=not self._progress_shown)
+            self._progress_shown = True
+        return False
+
+    def _hide_progress(self):
+        self.progress_bar.set_visible(False)
+        self.progress_bar.set_fraction(0)
+
+    def _on_fetch_done(self, token, image, content, info, max_size, url, source_id, started, queued):
+        # How long the result waited for the main loop
+        get_default_metrics().observe("dispatch", time.monotonic() - queued, source=source_id)
+        tracer = get_tracer()
+        if tracer:
+            tracer.complete("dispatch", queued, source=source_id, current=self._is_current_fetch(token))
+        self.latency.record(source_id, time.monotonic() - started)
+        self.breaker.record_success(source_id)
+        if self._is_current_fetch(token):
+            self._fetch_token = None
+            self._cancel_hedge()
+            # Stops the other attempt if the fetch was hedged
+            token.cancel()
+            self._on_image_loaded(image, content, info, max_size, url, source_id)
+        return False
+
+    def _on_fetch_failed(self, token, error, source_id):
+        self.breaker.record_failure(source_id)
+        if not self._is_current_fetch(token):
+            return False
+        self._pending_attempts -= 1
+        if self._get_hedging_enabled() and not self._hedged:
+            # Fail over right away instead of waiting for the deadline
+            self._cancel_hedge()
+            self._hedged = True
+            fallback = self._get_fallback_source(source_id)
+            if fallback:
+                self._start_attempt(fallback, False)
+                return False
+        if self._pending_attempts > 0:
+            # The other attempt may still succeed
+            return False
+        self._fetch_token = None
+        self._cancel_hedge()
+        self._on_image_error(error)
+        return False
+
+    def _on_image_loaded(self, image, content, info, max_size=None, url=None, source_id=None, add_to_history=True):
+        deadline, self._slideshow_deadline = self._slideshow_deadline, None
+        if deadline is not None:
+            late = time.monotonic() - deadline
+            if late < 0:
+                # Ready ahead of its slideshow tick, held until then
+                self.spinner.stop()
+                self.spinner.set_visible(False)
+                self._hide_progress()
+                self._held_image = (image, content, info, max_size, url, source_id, add_to_history)
+                self._held_image_id = GLib.timeout_add(int(-late * 1000), self._on_held_image_due)
+                return
+            get_default_metrics().observe("slideshow_late", late, source=source_id)
+        self._show_image(image, content, info, max_size, url, source_id, add_to_history)
+
+    def _on_held_image_due(self):
+        self._held_image_id = None
+        held, self._held_image = self._held_image, None
+        self._show_image(*held)
+        return False
+
+    def _show_held_image(self):
+        GLib.source_remove(self._held_image_id)
+        self._on_held_image_due()
+
+    def _show_image(self, image, content, info, max_size, url, source_id, add_to_history):
+        with trace_span("display", source=source_id):
+            displayed = time.monotonic()
+            try:
+                self.info = info
+                # The untouched file that was shown, used when saving
+                self.imagecontent = content
+                self.image_url = url
+                self._image_source_id = source_id
+                self._original = None
             
-            # Loader is already closed and should have pixbuf
-            self.image.set_pixbuf(loader.get_pixbuf())
+                # Replaces the partial frame in place, cross-fades from the previous image otherwise
+                self._present(image.texture, new_image=not self._progress_shown)
+                self._decode_size = self._get_decode_size(image, max_size)
+                self._schedule_redecode()
             
-            image_format = loader.get_format()
-            if image_format and image_format.extensions:
-                self.image_extension = image_format.extensions[0]
+                if image.extension:
+                    self.image_extension = image.extension
                 
-            self.image.set_visible(True)
-        except Exception as e:
-            print(f"Error displaying image: {e}")
-        finally:
-            self._finish_loading()
+                startup_mark("first-image-shown", once=True)
+                if add_to_history and url:
+                    downloader = self.downloaders.get(source_id)
+                    if downloader:
+                        downloader.mark_seen(info)
+                    self.history.append(url, source_id, downloader.get_history_info(info) if downloader else info)
+                    self.thumbnails.create_async(url, content)
+            except Exception as e:
+                print(f"Error displaying image: {e}")
+                get_default_metrics().increment("errors", stage="display", error=type(e).__name__, source=source_id)
+            finally:
+                get_default_metrics().observe("display", time.monotonic() - displayed, source=source_id or "history")
+                self._finish_loading()
             
+    def _present(self, texture, new_image=True):
+        """Shows texture, cross-fading from the current image when new_image is set."""
+        current = self.image_stack.get_visible_child()
+        target = current
+        if new_image and current.get_paintable() is not None:
+            target = self.back_picture if current is self.front_picture else self.front_picture
+        target.set_paintable(texture)
+        self.image_stack.set_visible(True)
+        self.image_stack.set_visible_child(target)
+        self._drop_hidden_image()
+
+    def _drop_hidden_image(self):
+        # Once the cross-fade is over only the shown texture is kept alive
+        if self.image_stack.get_transition_running():
+            return
+        for picture in (self.front_picture, self.back_picture):
+            if picture is not self.image_stack.get_visible_child():
+                picture.set_paintable(None)
+
+    def _get_display_size(self):
+        return self._display_size
+
+    def do_size_allocate(self, width, height, baseline):
+        Adw.ApplicationWindow.do_size_allocate(self, width, height, baseline)
+        scale = self.get_scale_factor()
+        display_size = (width * scale, height * scale)
+        if display_size != self._display_size:
+            self._display_size = display_size
+            for downloader in self.downloaders.values():
+                downloader.display_size = display_size
+            self._schedule_redecode()
+
+    def _get_decode_size(self, image, max_size):
+        """Returns the size limit the image was shrunk to fit, or None if it is full size."""
+        if not image or not max_size:
+            return None
+        if image.width < max_size[0] and image.height < max_size[1]:
+            return None
+        return max_size
+
+    def _schedule_redecode(self):
+        if self._decode_size is None or self.imagecontent is None:
+            return
+        if self._display_size[0] <= self._decode_size[0] and self._display_size[1] <= self._decode_size[1]:
+            return
+        if self._redecode_timeout_id is not None:
+            GLib.source_remove(self._redecode_timeout_id)
+        # Wait for resizing to settle before decoding again
+        self._redecode_timeout_id = GLib.timeout_add(250, self._start_redecode)
+
+    def _start_redecode(self):
+        self._redecode_timeout_id = None
+        token = self.executor.new_generation("redecode")
+        self.executor.submit(self._redecode_thread, self.imagecontent, self._display_size,
+                             priority=PRIORITY_USER, token=token)
+        return False
+
+    def _redecode_thread(self, content, max_size, token):
+        try:
+            image = decode_texture(content, max_size)
+        except Exception as e:
+            print(f"Error decoding image: {e}")
+            return
+        GLib.idle_add(self._on_redecoded, token, content, image, max_size)
+
+    def _on_redecoded(self, token, content, image, max_size):
+        # Drop the result if another image has been shown meanwhile
+        if not token.cancelled and content is self.imagecontent:
+            self._present(image.texture, new_image=False)
+            self._decode_size = self._get_decode_size(image, max_size)
+        return False
+
     def _on_image_error(self, error):
         print(f"Image loading error: {error}")
-        self._finish_loading()
+        self._slideshow_deadline = None
+        self._finish_loading("error")
 
-    def _finish_loading(self):
-        self.spinner.stop()
-        self.spinner.set_visible(False)
-        self._is_loading = False
-        if self.auto_reload_switch.get_active():
-            self._schedule_next_auto_reload()
+    def _finish_loading(self, outcome="shown"):
+        with trace_span("finish_loading"):
+            self.spinner.stop()
+            self.spinner.set_visible(False)
+            self._hide_progress()
+            self._is_loading = False
+            prefetcher = self.prefetchers.get(self._current_source_id)
+            if prefetcher:
+                prefetcher.refill()
+            self._update_budget_label()
+            if self.auto_reload_switch.get_active():
+                self._schedule_next_auto_reload()
+        self._trace_refresh_end(outcome)
+
+    def _get_rate_limit_budget(self):
+        """Returns the rate limit budget of the current source's API host, or None."""
+        downloader = self.downloaders.get(self._current_source_id)
+        if not downloader or not downloader.hosts:
+            return None
+        return self.http.limiter.budget(downloader.hosts[0])
+
+    def _get_rate_limit_wait(self) -> float:
+        budget = self._get_rate_limit_budget()
+        return budget["blocked"] if budget else 0
+
+    def _update_budget_label(self):
+        budget = self._get_rate_limit_budget()
+        text = None
+        if budget and budget["blocked"] >= 1:
+            text = f"Rate limited, {budget['blocked']:.0f} s"
+        elif budget and budget["remaining"] is not None:
+            text = f"{budget['remaining']} requests left"
+            if budget["limit"]:
+                text = f"{budget['remaining']}/{budget['limit']} requests left"
+        self.budget_label.set_visible(text is not None)
+        if text:
+            self.budget_label.set_label(text)
+        if budget and budget["blocked"] >= 1 and self._budget_timeout_id is None:
+            # Count the wait down
+            self._budget_timeout_id = GLib.timeout_add_seconds(1, self._on_budget_timeout)
+
+    def _on_budget_timeout(self):
+        self._budget_timeout_id = None
+        self._update_budget_label()
+        return False
 
     def file_chooser_dialog(self, ae=None):
         """Displays the dialog to save the image
@@ -410,26 +949,16 @@ class CatgirldownloaderWindow(Adw.ApplicationWindow):
         self.dialog = Gtk.FileChooserDialog(title="Save file", parent=self,
                                             action=Gtk.FileChooserAction.SAVE)
 
-        source_id = None
-        item = self.source_selector.get_selected_item()
-        if item:
-            source_id = item.id
-        
-        if not source_id:
-             if self.source_store.get_n_items() > 0:
-                 source_id = self.source_store.get_item(0).id
-             elif self.downloaders:
-                 source_id = next(iter(self.downloaders))
-
+        source_id = self._image_source_id or self._get_selected_source_id()
         downloader = self.downloaders.get(source_id)
+        file_extension = self._get_save_extension()
         
         current_name = "image"
         if downloader:
-             current_name = downloader.get_filename_suggestion(self.image_extension, self.info)
+             current_name = downloader.get_filename_suggestion(file_extension, self.info)
 
-        if self.image_extension:
+        if file_extension:
             # If we know the extension, add a filter for it
-            file_extension = self.image_extension
             image_filter = Gtk.FileFilter()
             image_filter.set_name(f"{file_extension.upper()} files")
             image_filter.add_pattern(f"*.{file_extension}")
@@ -446,10 +975,198 @@ class CatgirldownloaderWindow(Adw.ApplicationWindow):
     def responsehandler(self, dialog, response_id):
         """Save image and destroy file chooser"""
         if response_id == Gtk.ResponseType.OK:
-            file = dialog.get_file()
-            filename = file.get_path()
-            if self.imagecontent:
-                f = open(filename, "wb+")
-                f.write(self.imagecontent)
-                f.close()
+            self.save_image(dialog.get_file())
+        dialog.destroy()
+
+    def save_image(self, file):
+        """
+        Saves the image shown when this is called, preferably the full
+        original, to file without blocking the UI. Whatever is shown
+        afterwards, that image is written.
+        """
+        downloader = self.downloaders.get(self._image_source_id)
+        original_url = self._get_original_url()
+        if self._original is not None and self._original[0] == original_url:
+            self._write_image(file, self._original[1])
+            return
+        self.executor.submit(self._save_thread, downloader, original_url, self.image_url, self.imagecontent, file,
+                             priority=PRIORITY_USER)
+
+    def _save_thread(self, downloader, original_url, url, displayed, file, token):
+        path = file.get_path()
+        cached = self.cache.get_path(original_url or url) if path else None
+        if cached:
+            try:
+                # The kernel copies the cached file, the bytes never go through Python
+                atomic_copy(cached, path)
+                return
+            except OSError as e:
+                print(f"Error copying cached image: {e}")
+        content = displayed
+        if original_url and downloader:
+            try:
+                content = download(original_url, downloader.http, token)
+                downloader.cache.put(original_url, content)
+            except CancelledError:
+                raise
+            except Exception as e:
+                print(f"Could not download the original, saving the displayed image instead: {e}")
+                content = displayed
+        GLib.idle_add(self._write_image, file, content)
+
+    def _write_image(self, file, content):
+        if not content:
+            self._on_save_failed("nothing to save")
+            return False
+        # Written to a temporary file and renamed over the target by GIO
+        file.replace_contents_bytes_async(GLib.Bytes.new(bytes(content)), None, False,
+                                          Gio.FileCreateFlags.NONE, None, self._on_image_written)
+        return False
+
+    def _on_image_written(self, file, result):
+        try:
+            file.replace_contents_finish(result)
+        except GLib.Error as e:
+            self._on_save_failed(e.message)
+
+    def _on_save_failed(self, reason):
+        print(f"Error saving image: {reason}")
+        self.toast_overlay.add_toast(Adw.Toast.new("Could not save the image"))
+
+    def export_dialog(self):
+        """Asks for a folder and how many of the most recent images to export there."""
+        dialog = Gtk.FileChooserDialog(title="Export recent images", parent=self,
+                                       action=Gtk.FileChooserAction.SELECT_FOLDER)
+        counts = ["10", "25", "50", "100"]
+        dialog.add_choice("count", "Images", counts, [f"Last {count}" for count in counts])
+        dialog.set_choice("count", "25")
+        dialog.add_button('Cancel', Gtk.ResponseType.CANCEL)
+        dialog.add_button('Export', Gtk.ResponseType.OK)
+        dialog.connect('response', self._on_export_response)
+        dialog.show()
+
+    def _on_export_response(self, dialog, response_id):
+        folder = dialog.get_file()
+        if response_id == Gtk.ResponseType.OK and folder and folder.get_path():
+            self.export_recent(int(dialog.get_choice("count")), folder.get_path())
         dialog.destroy()
+
+    def export_recent(self, count, directory):
+        """Writes the count most recently shown images into directory in parallel."""
+        entries = []
+        names = set()
+        for position in range(min(count, self.history.get_n_items())):
+            item = self.history.get_item(position)
+            if not item.url:
+                continue
+            downloader = self.get_downloader(item.source_id) if item.source_id in self.AVAILABLE_SOURCES else None
+            # Like Save, export the full original rather than the variant that was shown
+            url = (downloader.get_original_url(item.info) if downloader else None) or item.url
+            extension = os.path.splitext(urlsplit(url).path)[1].lstrip(".") or None
+            name = downloader.get_filename_suggestion(extension, item.info) if downloader else None
+            if not name:
+                name = os.path.basename(urlsplit(url).path) or "image"
+            stem, suffix = os.path.splitext(name)
+            n = 1
+            while name in names:
+                n += 1
+                name = f"{stem}-{n}{suffix}"
+            names.add(name)
+            entries.append((url, name))
+        if not entries:
+            return
+
+        if self._export_job:
+            self._export_job.cancel()
+        job = ExportJob(entries, directory, self.cache, self.http, self.executor,
+                        lambda done, failed, total: GLib.idle_add(self._on_export_progress, job, done, failed, total))
+        self._export_job = job
+        self._on_export_progress(job, 0, 0, len(entries))
+        job.start()
+
+    def _on_export_progress(self, job, done, failed, total):
+        if job is not self._export_job:
+            return False
+        finished = done + failed
+        self.export_progress.set_visible(finished < total)
+        self.export_progress.set_fraction(finished / total)
+        self.export_progress.set_text(f"{finished}/{total}")
+        if finished == total:
+            self._export_job = None
+            if failed:
+                print(f"Exported {done} images, {failed} failed")
+        return False
+
+    def get_image_downloader(self):
+        """Returns the API of the source the shown image came from."""
+        return self.downloaders.get(self._image_source_id)
+
+    def _get_original_url(self):
+        downloader = self.downloaders.get(self._image_source_id)
+        original_url = downloader.get_original_url(self.info) if downloader and self.info else None
+        if original_url == self.image_url:
+            return None
+        return original_url
+
+    def _get_save_extension(self):
+        original_url = self._get_original_url()
+        if original_url:
+            extension = os.path.splitext(urlsplit(original_url).path)[1].lstrip(".")
+            if extension:
+                return extension
+        return self.image_extension
+
+    def fetch_original(self, callback=None):
+        """
+        Downloads the full original of the current image in the background if
+        only a smaller variant is shown, then calls callback with its content.
+        """
+        original_url = self._get_original_url()
+        if not original_url:
+            if callback:
+                callback(self.imagecontent)
+            return
+        if self._original is not None and self._original[0] == original_url:
+            if callback:
+                callback(self._original[1])
+            return
+        pending = self._original_fetch
+        if pending is not None and pending[0] == original_url:
+            # Already downloading, share the result instead of starting over
+            if callback:
+                pending[1].append(callback)
+            return
+        callbacks = [callback] if callback else []
+        self._original_fetch = (original_url, callbacks)
+        downloader = self.downloaders.get(self._image_source_id)
+        token = self.executor.new_generation("original")
+        if pending is not None:
+            # The download for the previous image was cancelled, its callers get None
+            for previous_callback in pending[1]:
+                previous_callback(None)
+        self.executor.submit(self._fetch_original_thread, downloader, original_url, callbacks,
+                             priority=PRIORITY_USER, token=token)
+
+    def _fetch_original_thread(self, downloader, url, callbacks, token):
+        try:
+            content = downloader.cache.get(url)
+            if content is None:
+                content = download(url, downloader.http, token)
+                downloader.cache.put(url, content)
+        except CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error downloading original: {e}")
+            content = None
+        GLib.idle_add(self._on_original_fetched, url, content, callbacks)
+
+    def _on_original_fetched(self, url, content, callbacks):
+        if self._original_fetch is None or self._original_fetch[1] is not callbacks:
+            # Superseded, the callbacks were already given None
+            return False
+        self._original_fetch = None
+        if content is not None and url == self._get_original_url():
+            self._original = (url, content)
+        for callback in callbacks:
+            callback(content)
+        return False